@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Разбор трассы срабатываний будильников (FIRE_TRACE_PATH)
+
+Считает распределение опозданий первого сообщения по часу срабатывания
+(в часовом поясе пользователя) и по часовым поясам, показывает самые
+поздние срабатывания.
+
+Примеры:
+    python analyze_fires.py fires.jsonl*
+    python analyze_fires.py fires.jsonl --hour 7 --late 5
+"""
+
+import argparse
+import json
+import sys
+from collections import defaultdict
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+
+def load_traces(paths):
+    """Читает записи из JSONL-файлов, пропуская поврежденные строки"""
+    traces = []
+    broken = 0
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    traces.append(json.loads(line))
+                except json.JSONDecodeError:
+                    broken += 1
+    if broken:
+        print(f"Пропущено поврежденных строк: {broken}", file=sys.stderr)
+    return traces
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def local_planned(trace) -> datetime:
+    """Запланированный момент в часовом поясе пользователя"""
+    return datetime.fromtimestamp(trace['planned'], ZoneInfo(trace.get('tz') or 'UTC'))
+
+
+def print_table(title: str, groups):
+    print(f"\n{title}")
+    print(f"{'':<32} {'шт':>8} {'p50, с':>9} {'p95, с':>9} {'p99, с':>9} {'max, с':>9} {'без отправки':>13}")
+    for key in sorted(groups):
+        values = sorted(v for v in groups[key] if v is not None)
+        unsent = len(groups[key]) - len(values)
+        print(f"{str(key):<32} {len(groups[key]):>8} {percentile(values, 0.5):>9.3f} {percentile(values, 0.95):>9.3f} "
+              f"{percentile(values, 0.99):>9.3f} {values[-1] if values else 0:>9.3f} {unsent:>13}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбор трассы срабатываний будильников")
+    parser.add_argument('paths', nargs='+', help="Файлы трассы (fires.jsonl, fires.jsonl.1, ...)")
+    parser.add_argument('--hour', type=int, help="Только срабатывания в этот час по времени пользователя")
+    parser.add_argument('--late', type=float, default=1.0, help="Порог опоздания (с) для списка поздних срабатываний")
+    parser.add_argument('--top', type=int, default=20, help="Сколько поздних срабатываний показать")
+    args = parser.parse_args()
+
+    traces = load_traces(args.paths)
+    if args.hour is not None:
+        traces = [t for t in traces if local_planned(t).hour == args.hour]
+    if not traces:
+        print("Нет записей")
+        return
+
+    # Опоздание первого сообщения: от запланированного момента до завершения первой отправки
+    by_hour = defaultdict(list)
+    by_tz = defaultdict(list)
+    late = []
+    for trace in traces:
+        lateness = trace['first_sent'] - trace['planned'] if trace.get('first_sent') is not None else None
+        by_hour[f"{local_planned(trace).hour:02d}:00"].append(lateness)
+        by_tz[trace.get('tz') or 'UTC'].append(lateness)
+        if lateness is not None and lateness >= args.late:
+            late.append((lateness, trace))
+
+    dispatch = sorted(t['dispatched'] - t['planned'] for t in traces)
+    print(f"Срабатываний: {len(traces)}, опоздание запуска: p50={percentile(dispatch, 0.5):.3f} с "
+          f"p99={percentile(dispatch, 0.99):.3f} с max={dispatch[-1]:.3f} с")
+    print_table("Опоздание первого сообщения по часу (время пользователя)", by_hour)
+    print_table("Опоздание первого сообщения по часовому поясу", by_tz)
+
+    late.sort(key=lambda item: item[0], reverse=True)
+    print(f"\nОпоздали на {args.late:g} с и больше: {len(late)}")
+    for lateness, trace in late[:args.top]:
+        print(f"  пользователь {trace['user_id']}: {local_planned(trace):%Y-%m-%d %H:%M} {trace.get('tz')}, "
+              f"опоздание {lateness:.3f} с, сообщений {trace.get('ticks')}, итог {trace.get('outcome')}")
+
+
+if __name__ == "__main__":
+    main()
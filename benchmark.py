@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки планировщика будильников на виртуальных часах
+Не требует токена и сети: Telegram заменен заглушкой, БД - хранилищем в памяти
+
+Примеры:
+    python benchmark.py day --alarms 100000
+    python benchmark.py day --alarms 1000000 --ticks 3
+    python benchmark.py memory --alarms 50000
+    python benchmark.py overload --rate 25
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, available_timezones
+
+# Настройки нужно задать до импорта бота
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import bot
+
+UTC = ZoneInfo('UTC')
+
+# Бюджеты памяти для режима memory (байты); превышение - регрессия
+MAX_ALARM_BYTES = float(os.getenv('BENCH_MAX_ALARM_BYTES', '3072'))
+MAX_SESSION_BYTES = float(os.getenv('BENCH_MAX_SESSION_BYTES', '4096'))
+
+
+class FakeBot:
+    """Заглушка Bot API: запоминает отправки и "нажимает стоп" после заданного числа сообщений"""
+
+    def __init__(self, clock: bot.VirtualClock, stop_after_ticks: int):
+        self.clock = clock
+        self.stop_after_ticks = stop_after_ticks
+        self.ticks: Counter = Counter()
+        # Момент первого сообщения каждого пользователя (UTC)
+        self.first_sends = {}
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.ticks[chat_id] += 1
+        if self.ticks[chat_id] == 1:
+            self.first_sends[chat_id] = self.clock.now(UTC)
+        if self.ticks[chat_id] >= self.stop_after_ticks:
+            bot.spam_active[chat_id] = False
+
+    async def get_me(self):
+        pass
+
+
+class SilentBot:
+    """Заглушка Bot API, которая ничего не запоминает: не искажает замеры памяти"""
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        pass
+
+    async def get_me(self):
+        pass
+
+
+class RateLimitedBot:
+    """Заглушка Bot API с ограниченной пропускной способностью
+
+    Отправки обслуживаются по очереди со скоростью rate сообщений в секунду
+    (как очередь перед лимитом Telegram), поэтому лишние повторы задерживают
+    первые сообщения новых будильников.
+    """
+
+    def __init__(self, clock: bot.VirtualClock, rate: float):
+        self.clock = clock
+        self.rate = rate
+        self._next_free = 0.0
+        self.sent = 0
+        self.first_sends = {}
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        now = self.clock.monotonic()
+        slot = max(now, self._next_free)
+        self._next_free = slot + 1 / self.rate
+        await self.clock.sleep(slot - now)
+        self.sent += 1
+        self.first_sends.setdefault(chat_id, self.clock.now(UTC))
+
+    async def get_me(self):
+        pass
+
+
+class FakeApp:
+    """Минимальная замена Application: планировщику нужен только app.bot"""
+
+    def __init__(self, fake_bot):
+        self.bot = fake_bot
+
+
+def expected_fire(start_utc: datetime, tz_name: str, hour: int, minute: int) -> datetime:
+    """Независимо от бота вычисляет момент срабатывания одноразового будильника"""
+    now = start_utc.astimezone(ZoneInfo(tz_name))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target < now:
+        target += timedelta(days=1)
+    return target.astimezone(UTC)
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def max_rss_mb() -> float:
+    """Пиковое потребление памяти процессом (МБ), если платформа это умеет"""
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux - килобайты, в macOS - байты
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+async def simulate_day(args) -> int:
+    """Планирует args.alarms одноразовых будильников в разных часовых поясах
+    и прогоняет сутки виртуального времени"""
+    rng = random.Random(args.seed)
+    timezones = sorted(tz for tz in available_timezones() if '/' in tz and not tz.startswith('Etc/'))
+    start_utc = datetime(2026, 1, 5, 12, 0, tzinfo=UTC)
+
+    clock = bot.VirtualClock(start_utc)
+    bot.clock = clock
+    bot.storage = bot.MemoryStorage()
+    fake_bot = FakeBot(clock, args.ticks)
+    app = FakeApp(fake_bot)
+
+    # Каждый пользователь получает один будильник в случайном часовом поясе
+    expected = {}
+    started = time.perf_counter()
+    for user_id in range(1, args.alarms + 1):
+        tz_name = rng.choice(timezones)
+        hour, minute = rng.randrange(24), rng.randrange(60)
+        bot.storage.set_timezone(user_id, tz_name)
+        alarm_time = datetime.strptime(f"{hour:02d}:{minute:02d}", "%H:%M")
+        alarm_id = bot.storage.replace_one_time_alarm(user_id, alarm_time.strftime("%H:%M"), "", start_utc.isoformat())
+        await bot.schedule_alarm(app, user_id, alarm_time, "", None, alarm_id)
+        expected[user_id] = expected_fire(start_utc, tz_name, hour, minute)
+    # Даем задачам дойти до ожидания
+    await clock.advance(0)
+    schedule_seconds = time.perf_counter() - started
+    print(f"Запланировано {args.alarms} будильников за {schedule_seconds:.2f} с, "
+          f"спящих корутин: {clock.pending}, пиковая память: {max_rss_mb():.0f} МБ")
+
+    started = time.perf_counter()
+    await clock.advance(timedelta(days=1, minutes=1).total_seconds() + args.ticks * 2)
+    run_seconds = time.perf_counter() - started
+
+    # Проверяем, что каждый будильник сработал ровно в свое время и в правильном порядке
+    missing = [user_id for user_id in expected if user_id not in fake_bot.first_sends]
+    lateness = sorted((fake_bot.first_sends[u] - expected[u]).total_seconds() for u in fake_bot.first_sends)
+    fire_order = sorted(fake_bot.first_sends, key=lambda u: (fake_bot.first_sends[u], u))
+    order_violations = sum(
+        1 for prev, cur in zip(fire_order, fire_order[1:]) if expected[prev] > expected[cur]
+    )
+    unfinished = sum(1 for tasks in bot.active_alarms.values() for task in tasks if not task.done())
+
+    print(f"Сутки виртуального времени прогнаны за {run_seconds:.2f} с")
+    print(f"Сообщений отправлено: {sum(fake_bot.ticks.values())}, сработало будильников: {len(fake_bot.first_sends)}, "
+          f"не сработало: {len(missing)}")
+    print(f"Опоздание первого сообщения (вирт. с): p50={percentile(lateness, 0.5):.3f} "
+          f"p99={percentile(lateness, 0.99):.3f} max={lateness[-1] if lateness else 0:.3f}")
+    print(f"Учет опозданий в боте: count={bot.metrics['fire_lateness_seconds_count']:.0f} "
+          f"max={bot.metrics['fire_lateness_seconds_max']:.3f}, "
+          f"первое сообщение max={bot.metrics['first_send_lateness_seconds_max']:.3f}, "
+          f"средний запас прогрева={bot.metrics['prewarm_lead_seconds_sum'] / max(bot.metrics['prewarm_lead_seconds_count'], 1):.3f}")
+    print(f"Нарушений порядка срабатывания: {order_violations}, незавершенных задач: {unfinished}")
+    print(f"Пиковая память: {max_rss_mb():.0f} МБ")
+
+    failed = missing or order_violations or unfinished or (lateness and lateness[-1] > args.max_lateness)
+    return 1 if failed else 0
+
+
+def traced_bytes() -> int:
+    """Текущий объем памяти, выделенной Python, после сборки мусора"""
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def print_top_allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, count: int, limit: int = 5):
+    """Печатает строки кода, на которые пришелся основной прирост памяти"""
+    for stat in after.compare_to(before, 'lineno')[:limit]:
+        frame = stat.traceback[0]
+        print(f"    {stat.size_diff / count:8.1f} Б/шт  {os.path.basename(frame.filename)}:{frame.lineno}")
+
+
+async def measure_memory(args) -> int:
+    """Замеряет tracemalloc'ом память одного запланированного будильника и одной сессии звонка"""
+    start_utc = datetime(2026, 1, 5, 12, 0, tzinfo=UTC)
+    clock = bot.VirtualClock(start_utc)
+    bot.clock = clock
+    bot.storage = bot.MemoryStorage()
+    app = FakeApp(SilentBot())
+    # Все будильники через час, в часовом поясе по умолчанию (UTC)
+    alarm_time = datetime.strptime((start_utc + timedelta(hours=1)).strftime("%H:%M"), "%H:%M")
+    users = range(1, args.alarms + 1)
+
+    # Строки в хранилище не относятся к планировщику: создаем их до замера
+    alarm_ids = [bot.storage.replace_one_time_alarm(user_id, alarm_time.strftime("%H:%M"), "", start_utc.isoformat())
+                 for user_id in users]
+    # Прогреваем кэши (часовые пояса, форматирование), чтобы они не попали в замер
+    await bot.schedule_alarm(app, 0, alarm_time)
+    await clock.advance(0)
+
+    tracemalloc.start()
+    baseline = traced_bytes()
+    before = tracemalloc.take_snapshot()
+    for user_id, alarm_id in zip(users, alarm_ids):
+        await bot.schedule_alarm(app, user_id, alarm_time, "", None, alarm_id)
+    # Даем задачам дойти до ожидания: кадр корутины растет при первом запуске
+    await clock.advance(0)
+    scheduled = traced_bytes()
+    scheduled_snapshot = tracemalloc.take_snapshot()
+    per_alarm = (scheduled - baseline) / args.alarms
+
+    # Все будильники срабатывают и звонят, пока пользователи не нажмут "стоп"
+    await clock.advance(3600)
+    ringing = traced_bytes()
+    ringing_snapshot = tracemalloc.take_snapshot()
+    per_session = (ringing - baseline) / args.alarms
+    sessions = sum(1 for user_id in users if bot.spam_active.get(user_id))
+    tracemalloc.stop()
+
+    print(f"Запланированный будильник: {per_alarm:.0f} Б (бюджет {args.max_alarm_bytes:.0f} Б)")
+    print_top_allocations(before, scheduled_snapshot, args.alarms)
+    print(f"Сессия звонка: {per_session:.0f} Б (бюджет {args.max_session_bytes:.0f} Б), звонит: {sessions} из {args.alarms}")
+    print_top_allocations(before, ringing_snapshot, args.alarms)
+    print(f"Оценка на 1 000 000 будильников: {per_alarm * 1e6 / 2**20:.0f} МБ, "
+          f"на 1 000 000 сессий: {per_session * 1e6 / 2**20:.0f} МБ")
+
+    # Останавливаем звонки и даем задачам завершиться
+    for user_id in users:
+        bot.spam_active[user_id] = False
+    await clock.advance(2)
+
+    failed = sessions != args.alarms or per_alarm > args.max_alarm_bytes or per_session > args.max_session_bytes
+    return 1 if failed else 0
+
+
+async def simulate_overload(args) -> int:
+    """Пик нагрузки: долгие звонки, которые никто не останавливает, и волна новых будильников"""
+    start_utc = datetime(2026, 1, 5, 6, 59, tzinfo=UTC)
+    clock = bot.VirtualClock(start_utc)
+    bot.clock = clock
+    bot.storage = bot.MemoryStorage()
+    bot.ring_governor = bot.RingGovernor(args.rate, bot.LONG_RING_AFTER, 1.0 if args.no_governor else args.max_stretch)
+    fake_bot = RateLimitedBot(clock, args.rate)
+    app = FakeApp(fake_bot)
+
+    # Звонящие пользователи: по args.per_minute новых каждую минуту с 07:00
+    user_id = 0
+    for minute in range(args.minutes):
+        alarm_time = datetime.strptime(f"07:{minute:02d}", "%H:%M")
+        for _ in range(args.per_minute):
+            user_id += 1
+            await bot.schedule_alarm(app, user_id, alarm_time)
+    # Волна новых будильников после того, как все звонки стали долгими
+    wave_time = datetime.strptime(f"07:{args.minutes + 2:02d}", "%H:%M")
+    wave_planned = start_utc.replace(minute=0, hour=7) + timedelta(minutes=args.minutes + 2)
+    wave = range(user_id + 1, user_id + args.wave + 1)
+    for wave_user in wave:
+        await bot.schedule_alarm(app, wave_user, wave_time)
+
+    started = time.perf_counter()
+    await clock.advance(timedelta(minutes=args.minutes + 4).total_seconds())
+    run_seconds = time.perf_counter() - started
+
+    lateness = sorted((fake_bot.first_sends[u] - wave_planned).total_seconds() for u in wave if u in fake_bot.first_sends)
+    missing = args.wave - len(lateness)
+    print(f"Прогнано {args.minutes + 4} мин виртуального времени за {run_seconds:.2f} с, "
+          f"звонков: {user_id}, новых будильников в волне: {args.wave}, лимит: {args.rate:g} сообщений/с")
+    print(f"Опоздание первого сообщения в волне (вирт. с): p50={percentile(lateness, 0.5):.3f} "
+          f"p99={percentile(lateness, 0.99):.3f} max={lateness[-1] if lateness else 0:.3f}, без сообщения: {missing}")
+    print(f"Сообщений: первых {bot.metrics['ring_sends_first']:.0f}, ранних повторов {bot.metrics['ring_sends_early']:.0f}, "
+          f"долгих повторов {bot.metrics['ring_sends_long']:.0f}")
+    print(f"Деградация: включалась {bot.metrics['ring_degradations']:.0f} раз, длилась {bot.metrics['ring_degraded_seconds']:.0f} с, "
+          f"растяжение до {max(bot.metrics['ring_stretch_max'], 1.0):.1f}x, нехватка даже при максимальном растяжении: "
+          f"{bot.metrics['ring_overload_unresolved']:.0f} пересчетов")
+
+    # Останавливаем все звонки
+    for tasks in bot.active_alarms.values():
+        for task in tasks:
+            task.cancel()
+    await clock.advance(0)
+
+    failed = missing or (lateness and lateness[-1] > args.max_lateness)
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки планировщика будильников")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    day = subparsers.add_parser('day', help="Сутки будильников в разных часовых поясах на виртуальных часах")
+    day.add_argument('--alarms', type=int, default=100000, help="Число будильников (по одному на пользователя)")
+    day.add_argument('--ticks', type=int, default=2, help="Сколько сообщений отправить до 'стоп'")
+    day.add_argument('--seed', type=int, default=1, help="Зерно генератора случайных чисел")
+    day.add_argument('--max-lateness', type=float, default=0.0, help="Допустимое опоздание (вирт. секунды)")
+
+    memory = subparsers.add_parser('memory', help="Память на один запланированный будильник и одну сессию звонка")
+    memory.add_argument('--alarms', type=int, default=50000, help="Число будильников (по одному на пользователя)")
+    memory.add_argument('--max-alarm-bytes', type=float, default=MAX_ALARM_BYTES,
+                        help="Бюджет памяти на запланированный будильник (байты)")
+    memory.add_argument('--max-session-bytes', type=float, default=MAX_SESSION_BYTES,
+                        help="Бюджет памяти на сессию звонка (байты)")
+
+    overload = subparsers.add_parser('overload', help="Первые сообщения новых будильников на фоне долгих звонков")
+    overload.add_argument('--rate', type=float, default=25, help="Пропускная способность (сообщений в секунду)")
+    overload.add_argument('--minutes', type=int, default=10, help="Сколько минут подряд начинаются звонки")
+    overload.add_argument('--per-minute', type=int, default=20, help="Сколько звонков начинается каждую минуту")
+    overload.add_argument('--wave', type=int, default=20, help="Сколько новых будильников срабатывает в пике")
+    overload.add_argument('--max-stretch', type=float, default=bot.MAX_RING_STRETCH, help="Максимальное растяжение долгих звонков")
+    overload.add_argument('--no-governor', action='store_true', help="Без приоритетов: все звонки с обычным интервалом")
+    overload.add_argument('--max-lateness', type=float, default=2.0, help="Допустимое опоздание первого сообщения (вирт. секунды)")
+
+    args = parser.parse_args()
+    bot.setup_logging()
+    if args.command == 'day':
+        sys.exit(asyncio.run(simulate_day(args)))
+    if args.command == 'memory':
+        sys.exit(asyncio.run(measure_memory(args)))
+    if args.command == 'overload':
+        sys.exit(asyncio.run(simulate_overload(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,125 +1,1077 @@
 import asyncio
+import atexit
+import cProfile
+import functools
+import heapq
+import io
 import logging
+import logging.handlers
 import os
+import queue
+import signal
+import socket
 import sqlite3
 import json
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+import warnings
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Set
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from zoneinfo import ZoneInfo
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram.error import RetryAfter
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, BaseUpdateProcessor
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Уровень логирования и период сводки по отправленным сообщениям будильников (секунды)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_SUMMARY_INTERVAL = float(os.getenv('LOG_SUMMARY_INTERVAL', '60'))
+
+# Фоновый поток записи логов; запускается точкой входа через setup_logging()
+log_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Настраивает логирование через очередь
+
+    Обработчики в event loop только кладут запись в очередь, а запись
+    в stderr выполняет фоновый поток QueueListener. Вызывается точками
+    входа (main, run_engine), а не при импорте: импорт модуля не должен
+    перенастраивать логирование приложения. Повторный вызов ничего не меняет.
+    """
+    global log_listener
+    if log_listener is not None:
+        return log_listener
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    # httpx пишет INFO на каждый запрос к Bot API, то есть на каждое сообщение будильника
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    listener.start()
+    atexit.register(listener.stop)
+    log_listener = listener
+    return listener
+
 logger = logging.getLogger(__name__)
 
+# Счетчики отправленных сообщений будильников для периодической сводки
+ring_log_stats: Counter = Counter()
+ring_log_users: Set[int] = set()
+
+async def log_ringing_summary(interval: float = LOG_SUMMARY_INTERVAL):
+    """Раз в interval секунд пишет в лог сводку по звонящим будильникам
+    вместо записи на каждое отправленное сообщение"""
+    while True:
+        await asyncio.sleep(interval)
+        if ring_log_stats:
+            logger.info(
+                "За %.0f с: отправлено %d сообщений будильника %d пользователям, ошибок отправки: %d, ограничений 429: %d",
+                interval, ring_log_stats['sent'], len(ring_log_users), ring_log_stats['errors'], ring_log_stats['retry_after']
+            )
+            ring_log_stats.clear()
+            ring_log_users.clear()
+
+# Трасса срабатываний будильников (JSONL): путь к файлу (пусто - выключена), размер файла и число архивных копий
+FIRE_TRACE_PATH = os.getenv('FIRE_TRACE_PATH', '')
+FIRE_TRACE_MAX_BYTES = int(os.getenv('FIRE_TRACE_MAX_BYTES', str(10 * 1024 * 1024)))
+FIRE_TRACE_BACKUPS = int(os.getenv('FIRE_TRACE_BACKUPS', '5'))
+# Сколько записей трассы может ждать записи; лишние отбрасываются
+FIRE_TRACE_QUEUE_SIZE = int(os.getenv('FIRE_TRACE_QUEUE_SIZE', '10000'))
+
+class FireTraceWriter:
+    """Пишет по записи на каждое срабатывание будильника в ротируемые JSONL-файлы
+
+    Event loop только кладет запись в очередь; фоновый поток забирает записи
+    пачками, пишет их одним вызовом и ротирует файл, как RotatingFileHandler:
+    fires.jsonl -> fires.jsonl.1 -> ... -> fires.jsonl.N.
+    Очередь ограничена: если диск не успевает, записи отбрасываются, а при
+    ошибке записи трасса отключается до перезапуска.
+    """
+
+    # Сколько записей писать за раз и как долго копить пачку (секунды)
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path: str = FIRE_TRACE_PATH, max_bytes: int = FIRE_TRACE_MAX_BYTES, backups: int = FIRE_TRACE_BACKUPS,
+                 queue_size: int = FIRE_TRACE_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._failed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None and not self._failed
+
+    def start(self):
+        if not self.path or self._thread is not None:
+            return
+        self._failed = False
+        self._thread = threading.Thread(target=self._run, name='fire-trace', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Дописывает накопленное и останавливает поток"""
+        if self._thread is None:
+            return
+        # Поток мог умереть при полной очереди: не ждем места вечно
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self._thread.join()
+        self._thread = None
+
+    def record(self, trace: dict):
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            metrics['fire_traces_dropped'] += 1
+
+    def _run(self):
+        file = None
+        try:
+            file = open(self.path, 'ab')
+            stopped = False
+            while not stopped:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.FLUSH_INTERVAL
+                while len(batch) < self.BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                    except queue.Empty:
+                        break
+                if None in batch:
+                    stopped = True
+                    batch = [trace for trace in batch if trace is not None]
+                if not batch:
+                    continue
+                data = ''.join(json.dumps(trace, separators=(',', ':')) + '\n' for trace in batch).encode()
+                if self.max_bytes and file.tell() and file.tell() + len(data) > self.max_bytes:
+                    file.close()
+                    self._rotate()
+                    file = open(self.path, 'ab')
+                file.write(data)
+                file.flush()
+                metrics['fire_traces_written'] += len(batch)
+        except Exception as e:
+            logger.error("Ошибка записи трассы срабатываний, трасса отключена: %s", e)
+            self._failed = True
+            # Освобождаем память от записей, которые уже не будут записаны
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+        finally:
+            if file is not None:
+                file.close()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+# Трасса срабатываний будильников
+fire_trace = FireTraceWriter()
+
 # Словарь для хранения активных будильников {user_id: [список задач]}
 active_alarms: Dict[int, List[asyncio.Task]] = {}
 
 # Словарь для флагов спама {user_id: True/False}
 spam_active: Dict[int, bool] = {}
 
+# Индекс ожидающих будильников {user_id: {ScheduledAlarm, ...}} для точечного перепланирования
+scheduled_alarms: Dict[int, Set['ScheduledAlarm']] = {}
+
+# Максимальное число обновлений, которые обрабатываются одновременно
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+# Максимальное число обновлений в обработке вместе с ожидающими своей очереди
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', '1024'))
+
+# Максимальная длина одного сна при ожидании будильника (секунды)
+MAX_SLEEP_CHUNK = float(os.getenv('MAX_SLEEP_CHUNK', '60'))
+# Расхождение настенных и монотонных часов, которое считается скачком времени (секунды)
+CLOCK_DRIFT_THRESHOLD = float(os.getenv('CLOCK_DRIFT_THRESHOLD', '0.5'))
+# За сколько секунд до срабатывания просыпаться, чтобы подготовить текст и соединение (0 - не просыпаться заранее)
+PREWARM_LEAD = float(os.getenv('PREWARM_LEAD', '2'))
+
+# Перегрузка исходящих сообщений: сколько сообщений в секунду можно отправлять, через сколько секунд
+# звонок считается долгим и во сколько раз можно растянуть интервал его сообщений
+OUTBOUND_RATE = float(os.getenv('OUTBOUND_RATE', '25'))
+LONG_RING_AFTER = float(os.getenv('LONG_RING_AFTER', '60'))
+MAX_RING_STRETCH = float(os.getenv('MAX_RING_STRETCH', '8'))
+
+# Сторож event loop: период замера задержки и порог, после которого loop считается заблокированным (секунды)
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.25'))
+# Включает отладочный режим asyncio с отчетами о медленных callback'ах
+LOOP_DEBUG = os.getenv('LOOP_DEBUG', '').lower() in ('1', 'true', 'yes')
+
+# Профилирование по команде /profile и сигналу SIGUSR2: каталог отчетов и длительность (секунды)
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_DEFAULT_SECONDS = float(os.getenv('PROFILE_DEFAULT_SECONDS', '30'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+
+# Ограничение частоты изменяющих команд: размер "ведра" и пополнение (токенов в секунду)
+THROTTLE_BURST = float(os.getenv('THROTTLE_BURST', '5'))
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', '0.2'))
+# Максимальное число будильников у одного пользователя
+MAX_ALARMS_PER_USER = int(os.getenv('MAX_ALARMS_PER_USER', '20'))
+
+# ID администраторов через запятую (для служебных команд)
+ADMIN_IDS: Set[int] = {int(x) for x in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if x}
+
+# Счетчики для мониторинга {название: значение}
+metrics: Counter = Counter()
+
+def observe(name: str, value: float):
+    """Учитывает наблюдение величины: количество, сумма и максимум"""
+    metrics[f'{name}_count'] += 1
+    metrics[f'{name}_sum'] += value
+    if value > metrics[f'{name}_max']:
+        metrics[f'{name}_max'] = value
+
+# Token bucket для каждого пользователя {user_id: [токены, время последнего пополнения]}
+throttle_buckets: Dict[int, List[float]] = {}
+# Пользователи, которым уже отправлено предупреждение об ограничении
+throttle_notified: Set[int] = set()
+
+def throttle_allow(user_id: int) -> bool:
+    """Списывает токен из ведра пользователя. Возвращает False, если токенов нет"""
+    now = time.monotonic()
+    bucket = throttle_buckets.get(user_id)
+    if bucket is None:
+        # Не даем словарю расти бесконечно: выкидываем полностью пополненные ведра
+        if len(throttle_buckets) >= 10000:
+            for uid, (tokens, updated) in list(throttle_buckets.items()):
+                if tokens + (now - updated) * THROTTLE_RATE >= THROTTLE_BURST:
+                    del throttle_buckets[uid]
+                    throttle_notified.discard(uid)
+        bucket = throttle_buckets[user_id] = [THROTTLE_BURST, now]
+    else:
+        bucket[0] = min(THROTTLE_BURST, bucket[0] + (now - bucket[1]) * THROTTLE_RATE)
+        bucket[1] = now
+
+    if bucket[0] < 1:
+        return False
+    bucket[0] -= 1
+    return True
+
+def throttled(handler):
+    """Декоратор для изменяющих команд: отклоняет их при превышении лимита частоты
+    до любой работы с БД и планировщиком"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if not throttle_allow(user_id):
+            metrics['throttled_events'] += 1
+            # Предупреждаем один раз за серию, чтобы не тратить запросы к Bot API
+            if user_id not in throttle_notified:
+                throttle_notified.add(user_id)
+                await update.effective_message.reply_text(
+                    "⏳ Слишком много команд подряд. Подождите немного и попробуйте снова."
+                )
+            return
+        throttle_notified.discard(user_id)
+        return await handler(update, context)
+    return wrapper
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных пользователей параллельно,
+    а обновления одного пользователя - строго по очереди
+
+    Семафор базового класса ограничивает общее число принятых обновлений
+    (MAX_PENDING_UPDATES), а собственный семафор - число реально выполняемых
+    обработчиков (MAX_CONCURRENT_UPDATES). Слот выполнения занимается только
+    после получения блокировки пользователя, поэтому очередь одного
+    пользователя не отнимает слоты у остальных.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._in_flight = asyncio.Semaphore(max_concurrent_updates)
+        # Блокировки по пользователям {user_id: Lock} и число их владельцев/ожидающих
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._user_waiters: Dict[int, int] = {}
+
+    @staticmethod
+    def _get_user_key(update: object) -> Optional[int]:
+        """Возвращает ключ упорядочивания для обновления (ID пользователя или чата)"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        user_key = self._get_user_key(update)
+        if user_key is None:
+            async with self._in_flight:
+                await coroutine
+            return
+
+        # Блокировка берется до первого await, поэтому порядок задач сохраняется
+        lock = self._user_locks.get(user_key)
+        if lock is None:
+            lock = self._user_locks[user_key] = asyncio.Lock()
+        self._user_waiters[user_key] = self._user_waiters.get(user_key, 0) + 1
+        try:
+            async with lock:
+                async with self._in_flight:
+                    await coroutine
+        finally:
+            self._user_waiters[user_key] -= 1
+            if not self._user_waiters[user_key]:
+                # Больше никто не ждет - освобождаем память
+                del self._user_waiters[user_key]
+                del self._user_locks[user_key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+class Deadline:
+    """Момент пробуждения, который можно перенести, не пересоздавая ожидающую задачу"""
+
+    __slots__ = ('target_utc', 'waiter')
+
+    def __init__(self, target_utc: datetime):
+        self.target_utc = target_utc
+        # Future текущего сна; move() завершает его досрочно
+        self.waiter: Optional[asyncio.Future] = None
+
+    def move(self, target_utc: datetime):
+        """Переносит момент пробуждения; ожидающий сразу пересчитает время сна"""
+        self.target_utc = target_utc
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+def _wake_waiter(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class Clock:
+    """Источник времени для планировщика и звонков
+
+    Весь код планирования и отправки будильников берет время и спит только
+    через текущие часы (глобальная переменная clock), поэтому в тестах и
+    бенчмарках их можно заменить на VirtualClock.
+    """
+
+    def now(self, tz=None) -> datetime:
+        """Текущее время в часовом поясе tz"""
+        return datetime.now(tz)
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float, deadline: Optional[Deadline] = None):
+        """Спит seconds секунд; если передан deadline, его move() прерывает сон"""
+        if deadline is None:
+            await asyncio.sleep(seconds)
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        handle = loop.call_later(seconds, _wake_waiter, future)
+        deadline.waiter = future
+        try:
+            await future
+        finally:
+            handle.cancel()
+            deadline.waiter = None
+
+    async def sleep_until(self, target, lead: float = 0.0) -> float:
+        """Ждет наступления момента (за lead секунд до него) и возвращает опоздание в секундах
+
+        target - datetime в UTC или Deadline, который можно перенести во время ожидания.
+        asyncio.sleep идет по монотонным часам, которые не учитывают коррекцию
+        времени NTP и приостановку ВМ. Поэтому ждем отрезками не длиннее
+        MAX_SLEEP_CHUNK и после каждого заново сверяемся с UTC. Сами скачки
+        времени замечает и учитывает LoopWatchdog, один раз на процесс.
+        """
+        deadline = target if isinstance(target, Deadline) else Deadline(target)
+        utc = ZoneInfo('UTC')
+        while True:
+            wall_now = self.now(utc)
+            remaining = (deadline.target_utc - wall_now).total_seconds() - lead
+            if remaining <= 0:
+                return -remaining
+            
+            await self.sleep(min(remaining, MAX_SLEEP_CHUNK), deadline)
+
+class VirtualClock(Clock):
+    """Виртуальные часы: время стоит на месте, пока его не сдвинут advance()
+
+    Спящие корутины хранятся в куче по моменту пробуждения, advance()
+    будит их по порядку, поэтому сутки будильников проходят за секунды.
+    """
+
+    # Сколько проходов event loop подряд без новых снов считаются затишьем
+    SETTLE_ROUNDS = 10
+
+    def __init__(self, start: Optional[datetime] = None):
+        utc = ZoneInfo('UTC')
+        self._now = (start or datetime.now(utc)).astimezone(utc)
+        self._elapsed = 0.0
+        # Куча (момент пробуждения в секундах от старта, порядковый номер, future)
+        self._sleepers: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = 0
+
+    def now(self, tz=None) -> datetime:
+        if tz is None:
+            return self._now.replace(tzinfo=None)
+        return self._now.astimezone(tz)
+
+    def monotonic(self) -> float:
+        return self._elapsed
+
+    async def sleep(self, seconds: float, deadline: Optional[Deadline] = None):
+        # Каждый вызов меняет порядковый номер: по нему _settle видит, что задачи еще работают
+        self._seq += 1
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self._elapsed + seconds, self._seq, future))
+        if deadline is not None:
+            deadline.waiter = future
+        try:
+            await future
+        finally:
+            if deadline is not None:
+                deadline.waiter = None
+
+    async def sleep_until(self, target, lead: float = 0.0) -> float:
+        # В виртуальном времени нет дрейфа: спим ровно до нужного момента
+        deadline = target if isinstance(target, Deadline) else Deadline(target)
+        while True:
+            remaining = (deadline.target_utc - self._now).total_seconds() - lead
+            if remaining <= 0:
+                return -remaining
+            await self.sleep(remaining, deadline)
+
+    @property
+    def pending(self) -> int:
+        """Сколько корутин сейчас спит"""
+        return len(self._sleepers)
+
+    async def _settle(self):
+        """Дает разбуженным задачам доработать до следующего сна
+
+        Отдает управление event loop, пока число спящих и порядковый номер
+        сна не перестанут меняться SETTLE_ROUNDS проходов подряд.
+        """
+        state = None
+        quiet = 0
+        while quiet < self.SETTLE_ROUNDS:
+            await asyncio.sleep(0)
+            current = (self._seq, len(self._sleepers))
+            if current == state:
+                quiet += 1
+            else:
+                state, quiet = current, 0
+
+    async def advance(self, seconds: float):
+        """Сдвигает время на seconds, по порядку будя всех, чей срок наступил"""
+        deadline = self._elapsed + seconds
+        await self._settle()
+        while self._sleepers and self._sleepers[0][0] <= deadline:
+            wake_at = self._sleepers[0][0]
+            self._move_to(wake_at)
+            # Будим всех с одинаковым моментом пробуждения одной пачкой
+            while self._sleepers and self._sleepers[0][0] <= wake_at:
+                _, _, future = heapq.heappop(self._sleepers)
+                if not future.done():
+                    future.set_result(None)
+            await self._settle()
+        self._move_to(deadline)
+
+    def _move_to(self, elapsed: float):
+        if elapsed > self._elapsed:
+            self._now += timedelta(seconds=elapsed - self._elapsed)
+            self._elapsed = elapsed
+
+# Текущие часы
+clock: Clock = Clock()
+
+# Хранилище: 'sqlite' (по умолчанию) или 'memory' (для тестов и бенчмарков)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')
+# Путь к БД и число файлов-шардов (при DB_SHARDS > 1 создаются alarms.0.db, alarms.1.db, ...)
+DB_PATH = os.getenv('DB_PATH', 'alarms.db')
+DB_SHARDS = int(os.getenv('DB_SHARDS', '1'))
+
+# Строка будильника: (alarm_time, message, repeat_days)
+AlarmRow = Tuple[str, Optional[str], Optional[str]]
+
+class AlarmStorage(ABC):
+    """Интерфейс хранилища будильников и часовых поясов
+
+    Через него работают обработчики команд, планировщик и загрузка будильников.
+    Повторяющимся считается будильник с непустым repeat_days (JSON-список дней).
+    """
+
+    @abstractmethod
+    def init(self) -> None:
+        """Создает таблицы и выполняет миграции"""
+
+    @abstractmethod
+    def get_timezone(self, user_id: int) -> Optional[str]:
+        """Возвращает часовой пояс пользователя или None, если он не задан"""
+
+    @abstractmethod
+    def set_timezone(self, user_id: int, timezone: str) -> None:
+        """Сохраняет часовой пояс пользователя"""
+
+    @abstractmethod
+    def get_alarms(self, user_id: int) -> List[AlarmRow]:
+        """Возвращает все несработавшие будильники пользователя"""
+
+    @abstractmethod
+    def get_recurring_alarms(self, user_id: int) -> List[AlarmRow]:
+        """Возвращает повторяющиеся будильники пользователя"""
+
+    @abstractmethod
+    def count_alarms(self, user_id: int, exclude_recurring_time: Optional[str] = None, recurring_only: bool = False) -> int:
+        """Считает несработавшие будильники пользователя
+
+        Args:
+            user_id: ID пользователя
+            exclude_recurring_time: Не учитывать повторяющиеся будильники с этим временем (HH:MM)
+            recurring_only: Считать только повторяющиеся будильники
+        """
+
+    @abstractmethod
+    def replace_one_time_alarm(self, user_id: int, alarm_time: str, message: str, created_at: str) -> int:
+        """Заменяет одноразовые будильники пользователя новым, возвращает его ID"""
+
+    @abstractmethod
+    def replace_recurring_alarm(self, user_id: int, alarm_time: str, message: str, created_at: str, repeat_days: str) -> int:
+        """Заменяет повторяющийся будильник с тем же временем новым, возвращает его ID"""
+
+    @abstractmethod
+    def delete_one_time_alarms(self, user_id: int) -> None:
+        """Удаляет одноразовые будильники пользователя"""
+
+    @abstractmethod
+    def iter_all_alarms(self) -> Iterator[Tuple[int, int, str, Optional[str], Optional[str]]]:
+        """Перебирает несработавшие будильники: (alarm_id, user_id, alarm_time, message, repeat_days)"""
+
+    @abstractmethod
+    def mark_fired(self, user_id: int, alarm_id: int, fired_at: str) -> None:
+        """Отмечает одноразовый будильник сработавшим; строку потом удалит purge_fired"""
+
+    @abstractmethod
+    def purge_fired(self, limit: int) -> int:
+        """Удаляет не больше limit сработавших одноразовых будильников, возвращает их число"""
+
+    @abstractmethod
+    def optimize(self) -> None:
+        """Обновляет статистику и возвращает свободное место"""
+
+    @abstractmethod
+    def try_acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Захватывает или продлевает аренду name на ttl секунд
+
+        Удается, если аренда свободна, истекла или уже принадлежит holder.
+        """
+
+    @abstractmethod
+    def release_lease(self, name: str, holder: str) -> None:
+        """Освобождает аренду, если она принадлежит holder"""
+
+    @contextmanager
+    def batch(self):
+        """Группирует записи внутри блока в одну транзакцию (на каждый шард)"""
+        yield
+
+    def warm_cache(self) -> Set[str]:
+        """Прочитывает будильники, чтобы прогреть кэш, и возвращает часовые пояса пользователей
+
+        Вызывается резервным экземпляром из отдельного потока, поэтому не
+        должен трогать соединения, которыми пользуется event loop.
+        """
+        return set()
+
+    def close(self) -> None:
+        """Освобождает ресурсы хранилища"""
+
+class MemoryStorage(AlarmStorage):
+    """Хранилище в памяти процесса. Данные теряются при перезапуске"""
+
+    def __init__(self):
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._timezones: Dict[int, str] = {}
+        # {user_id: [[id, alarm_time, message, created_at, repeat_days, fired_at], ...]}
+        self._alarms: Dict[int, List[list]] = {}
+        self._next_id = 1
+
+    def init(self) -> None:
+        pass
+
+    def get_timezone(self, user_id: int) -> Optional[str]:
+        return self._timezones.get(user_id)
+
+    def set_timezone(self, user_id: int, timezone: str) -> None:
+        self._timezones[user_id] = timezone
+
+    def get_alarms(self, user_id: int) -> List[AlarmRow]:
+        return [(a[1], a[2], a[4]) for a in self._alarms.get(user_id, []) if not a[5]]
+
+    def get_recurring_alarms(self, user_id: int) -> List[AlarmRow]:
+        return [(a[1], a[2], a[4]) for a in self._alarms.get(user_id, []) if a[4]]
+
+    def count_alarms(self, user_id: int, exclude_recurring_time: Optional[str] = None, recurring_only: bool = False) -> int:
+        count = 0
+        for alarm in self._alarms.get(user_id, []):
+            if alarm[5] or recurring_only and not alarm[4]:
+                continue
+            if exclude_recurring_time and alarm[4] and alarm[1] == exclude_recurring_time:
+                continue
+            count += 1
+        return count
+
+    def _insert(self, user_id: int, alarm_time: str, message: str, created_at: str, repeat_days: Optional[str]) -> int:
+        alarm_id = self._next_id
+        self._next_id += 1
+        self._alarms.setdefault(user_id, []).append([alarm_id, alarm_time, message, created_at, repeat_days, None])
+        return alarm_id
+
+    def replace_one_time_alarm(self, user_id: int, alarm_time: str, message: str, created_at: str) -> int:
+        self.delete_one_time_alarms(user_id)
+        return self._insert(user_id, alarm_time, message, created_at, None)
+
+    def replace_recurring_alarm(self, user_id: int, alarm_time: str, message: str, created_at: str, repeat_days: str) -> int:
+        self._alarms[user_id] = [a for a in self._alarms.get(user_id, []) if not (a[4] and a[1] == alarm_time)]
+        return self._insert(user_id, alarm_time, message, created_at, repeat_days)
+
+    def delete_one_time_alarms(self, user_id: int) -> None:
+        if user_id in self._alarms:
+            self._alarms[user_id] = [a for a in self._alarms[user_id] if a[4]]
+
+    def iter_all_alarms(self) -> Iterator[Tuple[int, int, str, Optional[str], Optional[str]]]:
+        for user_id, alarms in list(self._alarms.items()):
+            for alarm in alarms:
+                if not alarm[5]:
+                    yield alarm[0], user_id, alarm[1], alarm[2], alarm[4]
+
+    def mark_fired(self, user_id: int, alarm_id: int, fired_at: str) -> None:
+        for alarm in self._alarms.get(user_id, []):
+            if alarm[0] == alarm_id and not alarm[4]:
+                alarm[5] = fired_at
+
+    def purge_fired(self, limit: int) -> int:
+        purged = 0
+        for user_id in list(self._alarms):
+            if purged >= limit:
+                break
+            kept = []
+            for alarm in self._alarms[user_id]:
+                if alarm[5] and purged < limit:
+                    purged += 1
+                else:
+                    kept.append(alarm)
+            if kept:
+                self._alarms[user_id] = kept
+            else:
+                del self._alarms[user_id]
+        return purged
+
+    def optimize(self) -> None:
+        pass
+
+    def try_acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        now = time.time()
+        current = self._leases.get(name)
+        if current and current[0] != holder and current[1] > now:
+            return False
+        self._leases[name] = (holder, now + ttl)
+        return True
+
+    def release_lease(self, name: str, holder: str) -> None:
+        if self._leases.get(name, ('', 0))[0] == holder:
+            del self._leases[name]
+
+    def warm_cache(self) -> Set[str]:
+        return set(list(self._timezones.values()))
+
+# Условие "будильник повторяющийся" для SQL-запросов
+RECURRING_SQL = "repeat_days IS NOT NULL AND repeat_days != ''"
+
+class ShardedSQLiteStorage(AlarmStorage):
+    """SQLite-хранилище, разбитое на несколько файлов по user_id
+
+    Все данные пользователя лежат в шарде user_id % shards, поэтому записи
+    разных пользователей не конкурируют за блокировку одного файла.
+    ID будильника кодирует шард: id = local_id * shards + shard.
+    """
+
+    # Сколько страниц освобождать за один incremental_vacuum
+    VACUUM_PAGES = 1000
+
+    def __init__(self, path: str = 'alarms.db', shards: int = 1):
+        if shards < 1:
+            raise ValueError("Число шардов должно быть положительным")
+        self.shards = shards
+        if shards == 1:
+            self.paths = [path]
+        else:
+            base, ext = os.path.splitext(path)
+            self.paths = [f"{base}.{i}{ext}" for i in range(shards)]
+        self._connections: List[Optional[sqlite3.Connection]] = [None] * shards
+        # Глубина вложенности batch(): пока она больше нуля, записи не фиксируются
+        self._batch_depth = 0
+
+    def _conn(self, shard: int) -> sqlite3.Connection:
+        """Возвращает соединение с шардом, открывая его при первом обращении"""
+        conn = self._connections[shard]
+        if conn is None:
+            conn = sqlite3.connect(self.paths[shard])
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._connections[shard] = conn
+        return conn
+
+    @contextmanager
+    def _write(self, conn: sqlite3.Connection):
+        """Транзакция записи; внутри batch() фиксация откладывается до конца пачки"""
+        if self._batch_depth:
+            yield
+        else:
+            with conn:
+                yield
+
+    @contextmanager
+    def batch(self):
+        self._batch_depth += 1
+        try:
+            yield
+        except BaseException:
+            if self._batch_depth == 1:
+                for conn in self._connections:
+                    if conn is not None:
+                        conn.rollback()
+            raise
+        else:
+            if self._batch_depth == 1:
+                for conn in self._connections:
+                    if conn is not None:
+                        conn.commit()
+        finally:
+            self._batch_depth -= 1
+
+    def _user_conn(self, user_id: int) -> Tuple[sqlite3.Connection, int]:
+        shard = user_id % self.shards
+        return self._conn(shard), shard
+
+    def init(self) -> None:
+        for shard in range(self.shards):
+            conn = self._conn(shard)
+            cursor = conn.cursor()
+            # Режим incremental vacuum: для уже существующей БД включается только после VACUUM
+            if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                cursor.execute('VACUUM')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS alarms (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    alarm_time TEXT NOT NULL,
+                    message TEXT,
+                    created_at TEXT NOT NULL,
+                    repeat_days TEXT
+                )
+            ''')
+            # Добавляем колонку repeat_days если её нет (для существующих БД)
+            try:
+                cursor.execute('ALTER TABLE alarms ADD COLUMN repeat_days TEXT')
+            except sqlite3.OperationalError:
+                pass  # Колонка уже существует
+            # Время срабатывания одноразового будильника (NULL - еще не сработал)
+            try:
+                cursor.execute('ALTER TABLE alarms ADD COLUMN fired_at TEXT')
+            except sqlite3.OperationalError:
+                pass  # Колонка уже существует
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_alarms_user_id ON alarms (user_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_alarms_fired_at ON alarms (fired_at) WHERE fired_at IS NOT NULL')
+            
+            # Создаем таблицу для часовых поясов пользователей
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_timezones (
+                    user_id INTEGER PRIMARY KEY,
+                    timezone TEXT NOT NULL DEFAULT 'UTC'
+                )
+            ''')
+            
+            # Таблица аренд (используется только в шарде 0)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+
+    def get_timezone(self, user_id: int) -> Optional[str]:
+        conn, _ = self._user_conn(user_id)
+        result = conn.execute('SELECT timezone FROM user_timezones WHERE user_id = ?', (user_id,)).fetchone()
+        return result[0] if result else None
+
+    def set_timezone(self, user_id: int, timezone: str) -> None:
+        conn, _ = self._user_conn(user_id)
+        with self._write(conn):
+            conn.execute('INSERT OR REPLACE INTO user_timezones (user_id, timezone) VALUES (?, ?)', (user_id, timezone))
+
+    def get_alarms(self, user_id: int) -> List[AlarmRow]:
+        conn, _ = self._user_conn(user_id)
+        return conn.execute(
+            'SELECT alarm_time, message, repeat_days FROM alarms WHERE user_id = ? AND fired_at IS NULL',
+            (user_id,)
+        ).fetchall()
+
+    def get_recurring_alarms(self, user_id: int) -> List[AlarmRow]:
+        conn, _ = self._user_conn(user_id)
+        return conn.execute(
+            f'SELECT alarm_time, message, repeat_days FROM alarms WHERE user_id = ? AND {RECURRING_SQL}',
+            (user_id,)
+        ).fetchall()
+
+    def count_alarms(self, user_id: int, exclude_recurring_time: Optional[str] = None, recurring_only: bool = False) -> int:
+        query = 'SELECT COUNT(*) FROM alarms WHERE user_id = ? AND fired_at IS NULL'
+        params: list = [user_id]
+        if recurring_only:
+            query += f' AND {RECURRING_SQL}'
+        if exclude_recurring_time:
+            query += f' AND NOT (alarm_time = ? AND {RECURRING_SQL})'
+            params.append(exclude_recurring_time)
+        conn, _ = self._user_conn(user_id)
+        return conn.execute(query, params).fetchone()[0]
+
+    def replace_one_time_alarm(self, user_id: int, alarm_time: str, message: str, created_at: str) -> int:
+        conn, shard = self._user_conn(user_id)
+        with self._write(conn):
+            conn.execute(f'DELETE FROM alarms WHERE user_id = ? AND NOT ({RECURRING_SQL})', (user_id,))
+            cursor = conn.execute(
+                'INSERT INTO alarms (user_id, alarm_time, message, created_at, repeat_days) VALUES (?, ?, ?, ?, ?)',
+                (user_id, alarm_time, message, created_at, None)
+            )
+        return cursor.lastrowid * self.shards + shard
+
+    def replace_recurring_alarm(self, user_id: int, alarm_time: str, message: str, created_at: str, repeat_days: str) -> int:
+        conn, shard = self._user_conn(user_id)
+        with self._write(conn):
+            conn.execute(f'DELETE FROM alarms WHERE user_id = ? AND alarm_time = ? AND {RECURRING_SQL}', (user_id, alarm_time))
+            cursor = conn.execute(
+                'INSERT INTO alarms (user_id, alarm_time, message, created_at, repeat_days) VALUES (?, ?, ?, ?, ?)',
+                (user_id, alarm_time, message, created_at, repeat_days)
+            )
+        return cursor.lastrowid * self.shards + shard
+
+    def delete_one_time_alarms(self, user_id: int) -> None:
+        conn, _ = self._user_conn(user_id)
+        with self._write(conn):
+            conn.execute(f'DELETE FROM alarms WHERE user_id = ? AND NOT ({RECURRING_SQL})', (user_id,))
+
+    def iter_all_alarms(self) -> Iterator[Tuple[int, int, str, Optional[str], Optional[str]]]:
+        for shard in range(self.shards):
+            yield from self._conn(shard).execute(
+                'SELECT id * ? + ?, user_id, alarm_time, message, repeat_days FROM alarms WHERE fired_at IS NULL',
+                (self.shards, shard)
+            ).fetchall()
+
+    def mark_fired(self, user_id: int, alarm_id: int, fired_at: str) -> None:
+        conn, shard = self._user_conn(user_id)
+        with self._write(conn):
+            conn.execute(
+                f'UPDATE alarms SET fired_at = ? WHERE id = ? AND NOT ({RECURRING_SQL})',
+                (fired_at, alarm_id // self.shards)
+            )
+
+    def purge_fired(self, limit: int) -> int:
+        purged = 0
+        for shard in range(self.shards):
+            if purged >= limit:
+                break
+            conn = self._conn(shard)
+            with conn:
+                cursor = conn.execute(
+                    'DELETE FROM alarms WHERE id IN (SELECT id FROM alarms WHERE fired_at IS NOT NULL LIMIT ?)',
+                    (limit - purged,)
+                )
+            purged += cursor.rowcount
+        return purged
+
+    def optimize(self) -> None:
+        for shard in range(self.shards):
+            conn = self._conn(shard)
+            conn.execute('ANALYZE')
+            conn.execute('PRAGMA optimize')
+            conn.execute(f'PRAGMA incremental_vacuum({self.VACUUM_PAGES})').fetchall()
+            conn.commit()
+
+    def try_acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        now = time.time()
+        conn = self._conn(0)
+        with conn:
+            # Атомарно: перезаписываем аренду, только если она наша или уже истекла.
+            # В режиме WAL это верно только для процессов одного хоста (не для сетевых ФС)
+            conn.execute('''
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            ''', (name, holder, now + ttl, now))
+            result = conn.execute('SELECT holder FROM leases WHERE name = ?', (name,)).fetchone()
+        return result is not None and result[0] == holder
+
+    def release_lease(self, name: str, holder: str) -> None:
+        conn = self._conn(0)
+        with conn:
+            conn.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+
+    def warm_cache(self) -> Set[str]:
+        timezones: Set[str] = set()
+        for path in self.paths:
+            # Свое соединение: соединения шардов привязаны к потоку event loop
+            conn = sqlite3.connect(path)
+            try:
+                timezones.update(row[0] for row in conn.execute('SELECT DISTINCT timezone FROM user_timezones'))
+                for _ in conn.execute('SELECT user_id, alarm_time, message, repeat_days FROM alarms WHERE fired_at IS NULL'):
+                    pass
+            finally:
+                conn.close()
+        return timezones
+
+    def close(self) -> None:
+        for shard, conn in enumerate(self._connections):
+            if conn is not None:
+                conn.close()
+                self._connections[shard] = None
+
+def create_storage() -> AlarmStorage:
+    """Создает хранилище по настройкам окружения"""
+    if STORAGE_BACKEND == 'memory':
+        return MemoryStorage()
+    if STORAGE_BACKEND == 'sqlite':
+        return ShardedSQLiteStorage(DB_PATH, DB_SHARDS)
+    raise ValueError(f"Неизвестное хранилище: {STORAGE_BACKEND}")
+
+# Текущее хранилище (соединения с БД открываются при первом обращении)
+storage: AlarmStorage = create_storage()
+
 # Функции для работы с часовыми поясами
 def get_user_timezone(user_id: int) -> str:
     """Получает часовой пояс пользователя из БД, по умолчанию UTC"""
-    conn = sqlite3.connect('alarms.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT timezone FROM user_timezones WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 'UTC'
+    return storage.get_timezone(user_id) or 'UTC'
 
 def set_user_timezone(user_id: int, timezone: str) -> bool:
     """Устанавливает часовой пояс пользователя"""
     try:
         # Проверяем, что часовой пояс валидный
         ZoneInfo(timezone)
-        conn = sqlite3.connect('alarms.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_timezones (user_id, timezone)
-            VALUES (?, ?)
-        ''', (user_id, timezone))
-        conn.commit()
-        conn.close()
+        storage.set_timezone(user_id, timezone)
         return True
     except Exception as e:
-        logger.error(f"Ошибка при установке часового пояса: {e}")
+        logger.error("Ошибка при установке часового пояса: %s", e)
         return False
 
+async def reply_alarm_limit(update: Update):
+    """Сообщает о превышении лимита будильников"""
+    metrics['alarm_limit_rejections'] += 1
+    await update.message.reply_text(
+        f"❌ **Достигнут лимит будильников ({MAX_ALARMS_PER_USER})**\n\n"
+        "Удалите лишние будильники командой `/stop` и попробуйте снова.",
+        parse_mode="Markdown"
+    )
+
+@functools.lru_cache(maxsize=None)
+def get_zone(timezone_str: str) -> ZoneInfo:
+    """Возвращает ZoneInfo из кэша
+
+    Собственный кэш ZoneInfo держит всего несколько поясов, остальные
+    при каждом обращении заново читаются с диска.
+    """
+    return ZoneInfo(timezone_str)
+
 def get_user_datetime_now(user_id: int) -> datetime:
     """Получает текущее время в часовом поясе пользователя"""
     timezone_str = get_user_timezone(user_id)
-    tz = ZoneInfo(timezone_str)
-    return datetime.now(tz)
+    tz = get_zone(timezone_str)
+    return clock.now(tz)
 
 # Инициализация БД
 def init_db():
-    conn = sqlite3.connect('alarms.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS alarms (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            alarm_time TEXT NOT NULL,
-            message TEXT,
-            created_at TEXT NOT NULL,
-            repeat_days TEXT
-        )
-    ''')
-    # Добавляем колонку repeat_days если её нет (для существующих БД)
-    try:
-        cursor.execute('ALTER TABLE alarms ADD COLUMN repeat_days TEXT')
-    except sqlite3.OperationalError:
-        pass  # Колонка уже существует
-    
-    # Создаем таблицу для часовых поясов пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_timezones (
-            user_id INTEGER PRIMARY KEY,
-            timezone TEXT NOT NULL DEFAULT 'UTC'
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    storage.init()
     logger.info("База данных инициализирована")
 
 # Загрузка сохраненных будильников из БД
+# Через сколько будильников при загрузке отдавать управление event loop
+LOAD_BATCH = 1000
+
 async def load_saved_alarms(app: Application):
-    conn = sqlite3.connect('alarms.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, alarm_time, message, repeat_days FROM alarms')
-    alarms = cursor.fetchall()
-    conn.close()
+    """Читает из БД и планирует сохраненные будильники
+
+    Между пачками по LOAD_BATCH управление отдается event loop, чтобы
+    долгая загрузка не останавливала продление аренды и обработку команд.
+    """
+    alarms = list(storage.iter_all_alarms())
     
-    for user_id, alarm_time, message, repeat_days in alarms:
+    for index, (alarm_id, user_id, alarm_time, message, repeat_days) in enumerate(alarms):
+        if index and index % LOAD_BATCH == 0:
+            await asyncio.sleep(0)
         try:
             alarm_datetime = datetime.strptime(alarm_time, "%H:%M")
             repeat_days_set = set(json.loads(repeat_days)) if repeat_days else None
-            await schedule_alarm(app, user_id, alarm_datetime, message or "", repeat_days_set)
+            await schedule_alarm(app, user_id, alarm_datetime, message or "", repeat_days_set, alarm_id)
         except Exception as e:
-            logger.error(f"Ошибка при загрузке будильника: {e}")
+            logger.error("Ошибка при загрузке будильника: %s", e)
 
-# Функция планирования будильника
-async def schedule_alarm(app: Application, user_id: int, alarm_time: datetime, message: str = "", repeat_days: Optional[Set[int]] = None):
-    """Планирует будильник на указанное время
-    
-    Args:
-        app: Приложение бота
-        user_id: ID пользователя
-        alarm_time: Время будильника (только час и минута)
-        message: Сообщение для будильника
-        repeat_days: Множество дней недели (0=понедельник, 6=воскресенье) для повторяющихся будильников
-    """
-    # Получаем текущее время в часовом поясе пользователя
-    now = get_user_datetime_now(user_id)
+class ScheduledAlarm(Deadline):
+    """Ожидающий будильник: параметры и момент срабатывания, который можно перенести"""
+
+    __slots__ = ('user_id', 'alarm_id', 'alarm_time', 'message', 'repeat_days')
+
+    def __init__(self, user_id: int, alarm_time: datetime, message: str, repeat_days: Optional[Set[int]], alarm_id: Optional[int], target_utc: datetime):
+        super().__init__(target_utc)
+        self.user_id = user_id
+        self.alarm_id = alarm_id
+        self.alarm_time = alarm_time
+        self.message = message
+        self.repeat_days = repeat_days
+
+def compute_alarm_target(now: datetime, alarm_time: datetime, repeat_days: Optional[Set[int]] = None) -> datetime:
+    """Вычисляет ближайший момент срабатывания будильника в часовом поясе now"""
     # Создаем datetime с текущей датой и указанным временем из alarm_time в часовом поясе пользователя
     target = now.replace(hour=alarm_time.hour, minute=alarm_time.minute, second=0, microsecond=0)
     
@@ -135,18 +1087,36 @@ async def schedule_alarm(app: Application, user_id: int, alarm_time: datetime, m
     # Если это повторяющийся будильник и сегодня подходящий день не найден
     if repeat_days and target.weekday() not in repeat_days:
         target = find_next_repeat_day(target, repeat_days, now)
+    return target
+
+# Функция планирования будильника
+async def schedule_alarm(app: Application, user_id: int, alarm_time: datetime, message: str = "", repeat_days: Optional[Set[int]] = None, alarm_id: Optional[int] = None, after: Optional[datetime] = None):
+    """Планирует будильник на указанное время
+    
+    Args:
+        app: Приложение бота
+        user_id: ID пользователя
+        alarm_time: Время будильника (только час и минута)
+        message: Сообщение для будильника
+        repeat_days: Множество дней недели (0=понедельник, 6=воскресенье) для повторяющихся будильников
+        alarm_id: ID будильника в БД (нужен, чтобы отметить одноразовый будильник сработавшим)
+        after: Искать срабатывание строго после этого момента (для следующего повтора сработавшего будильника)
+    """
+    # Получаем текущее время в часовом поясе пользователя
+    now = get_user_datetime_now(user_id)
+    if after is not None and now <= after:
+        now = after.astimezone(now.tzinfo) + timedelta(microseconds=1)
+    target = compute_alarm_target(now, alarm_time, repeat_days)
     
-    # Вычисляем задержку в секундах (конвертируем в UTC для расчета)
-    now_utc = datetime.now(ZoneInfo('UTC'))
-    target_utc = target.astimezone(ZoneInfo('UTC'))
-    delay = (target_utc - now_utc).total_seconds()
+    # Момент срабатывания в UTC: ожидание сверяется с настенными часами, а не с задержкой
+    target_utc = target.astimezone(get_zone('UTC'))
     
-    logger.info(f"Будильник запланирован для пользователя {user_id} на {target.strftime('%Y-%m-%d %H:%M %Z')} (повтор: {repeat_days is not None})")
+    logger.info("Будильник запланирован для пользователя %s на %s (повтор: %s)", user_id, target, repeat_days is not None)
     
-    # Создаем задачу
-    task = asyncio.create_task(
-        send_alarm(app, user_id, alarm_time, message, delay, repeat_days)
-    )
+    # Создаем задачу и добавляем будильник в индекс
+    alarm = ScheduledAlarm(user_id, alarm_time, message, repeat_days, alarm_id, target_utc)
+    scheduled_alarms.setdefault(user_id, set()).add(alarm)
+    task = asyncio.create_task(send_alarm(app, alarm))
     
     # Сохраняем задачу
     if user_id not in active_alarms:
@@ -166,65 +1136,642 @@ def find_next_repeat_day(target: datetime, repeat_days: Set[int], now: datetime)
         if candidate.weekday() in repeat_days:
             return candidate
     
-    # Если ничего не найдено (не должно произойти), возвращаем следующий день
-    return now + timedelta(days=1)
+    # Если ничего не найдено (не должно произойти), возвращаем следующий день
+    return now + timedelta(days=1)
+
+# Текст сообщения будильника
+def render_alarm_text(alarms: List[Tuple[datetime, str]], now_local: datetime) -> str:
+    """Текст сообщения будильника; alarms - (время, сообщение) всех звонящих будильников"""
+    times = ", ".join(dict.fromkeys(alarm_time.strftime('%H:%M') for alarm_time, _ in alarms))
+    alarm_text = f"⏰ БУДИЛЬНИК! Время: {times}\n🕐 Сейчас: {now_local.strftime('%H:%M:%S')}"
+    for _, message in alarms:
+        if message:
+            alarm_text += f"\n💬 {message}"
+    alarm_text += "\n\n❌ Напишите 'стоп' чтобы остановить"
+    return alarm_text
+
+class PreparedAlarm:
+    """Подготовленное к отправке срабатывание: часовой пояс и текст первого сообщения"""
+
+    __slots__ = ('zone', 'text', 'planned_utc')
+
+    def __init__(self, zone: ZoneInfo, text: str, planned_utc: datetime):
+        self.zone = zone
+        self.text = text
+        self.planned_utc = planned_utc
+
+class ConnectionWarmer:
+    """Не дает соединению с Bot API остыть перед срабатыванием будильников
+
+    Соединение считается теплым, если запрос к API был не больше IDLE
+    секунд назад; иначе выполняется легкий getMe. Одновременные прогревы
+    сливаются в один запрос. Прогрев идет в фоне: медленный Bot API не
+    должен задерживать первое сообщение будильника.
+    """
+
+    # Меньше времени простоя, после которого httpx закрывает соединение (5 с)
+    IDLE = 4.0
+
+    def __init__(self):
+        self.last_request = float('-inf')
+        self._inflight: Optional[asyncio.Future] = None
+
+    def touch(self):
+        """Отмечает успешный запрос к Bot API"""
+        self.last_request = time.monotonic()
+
+    def warm(self, app: Application):
+        """Запускает прогрев в фоне, не дожидаясь ответа"""
+        if time.monotonic() - self.last_request < self.IDLE:
+            return
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._warm(app))
+
+    async def _warm(self, app: Application):
+        try:
+            await app.bot.get_me()
+            self.touch()
+            metrics['connection_warmups'] += 1
+        except Exception as e:
+            logger.debug("Не удалось прогреть соединение с Bot API: %s", e)
+
+# Прогрев соединения с Bot API
+connection_warmer = ConnectionWarmer()
+
+async def prepare_alarm(app: Application, alarm: ScheduledAlarm, warm: bool = True) -> PreparedAlarm:
+    """Готовит срабатывание: часовой пояс из БД, текст первого сообщения, теплое соединение"""
+    zone = get_zone(get_user_timezone(alarm.user_id))
+    text = render_alarm_text([(alarm.alarm_time, alarm.message)], alarm.target_utc.astimezone(zone))
+    if warm:
+        connection_warmer.warm(app)
+    return PreparedAlarm(zone, text, alarm.target_utc)
+
+class RingingSession:
+    """Звонок пользователю: один цикл отправки на все сработавшие будильники
+
+    Будильник, сработавший во время звонка, добавляется в него: его сообщение
+    появляется в тексте со следующей отправки, а частота сообщений в чат
+    остается прежней.
+    """
+
+    __slots__ = ('user_id', 'prepared', 'alarms', 'traces', 'ticks', 'started', 'task')
+
+    def __init__(self, user_id: int, prepared: PreparedAlarm):
+        self.user_id = user_id
+        self.prepared = prepared
+        self.alarms: List[Tuple[datetime, str]] = []
+        # Записи трассы всех будильников звонка
+        self.traces: List[dict] = []
+        self.ticks = 0
+        # Начало звонка по монотонным часам
+        self.started = clock.monotonic()
+        self.task: Optional[asyncio.Task] = None
+
+    def add(self, alarm_time: datetime, message: str, trace: Optional[dict] = None):
+        self.alarms.append((alarm_time, message))
+        if trace is not None:
+            self.traces.append(trace)
+
+    def render(self) -> str:
+        if self.ticks == 0 and len(self.alarms) == 1:
+            # Текст первого сообщения подготовлен заранее
+            return self.prepared.text
+        return render_alarm_text(self.alarms, clock.now(self.prepared.zone))
+
+# Идущие звонки {user_id: RingingSession}
+ringing_sessions: Dict[int, RingingSession] = {}
+
+# Интервал между сообщениями звонка (секунды)
+RING_INTERVAL = 2.0
+
+class RingGovernor:
+    """Делит исходящую пропускную способность между звонками по приоритетам
+
+    Сообщения звонков делятся на три класса: первое сообщение будильника,
+    повтор в начале звонка и повтор долгого звонка (дольше LONG_RING_AFTER).
+    Если спрос превышает OUTBOUND_RATE, растягивается интервал только долгих
+    звонков (не больше чем в MAX_RING_STRETCH раз), чтобы первые сообщения
+    новых будильников уходили вовремя. Спрос на первые сообщения оценивается
+    по будильникам в окне прогрева (они сработают в ближайшие секунды)
+    и по недавним отправкам. Ответ Telegram 429 (RetryAfter) - прямой признак
+    перегрузки: пока он действует, долгие звонки растягиваются до предела.
+    """
+
+    # Как часто пересчитывать коэффициент растяжения (секунды)
+    RECOMPUTE_INTERVAL = 1.0
+
+    def __init__(self, rate: float = OUTBOUND_RATE, long_after: float = LONG_RING_AFTER, max_stretch: float = MAX_RING_STRETCH):
+        self.rate = rate
+        self.long_after = long_after
+        self.max_stretch = max(max_stretch, 1.0)
+        self.stretch = 1.0
+        # Будильники в окне прогрева: их первые сообщения вот-вот понадобятся
+        self.pending_first = 0
+        # Первые сообщения по секундам монотонных часов
+        self._first_sends: Counter = Counter()
+        self._computed_at: Optional[float] = None
+        self._degraded_since: Optional[float] = None
+        # До какого момента (по монотонным часам) действует последний RetryAfter
+        self._saturated_until: Optional[float] = None
+
+    def classify(self, session: 'RingingSession') -> str:
+        """Класс очередного сообщения звонка: first, early или long"""
+        if session.ticks == 0:
+            return 'first'
+        if clock.monotonic() - session.started < self.long_after:
+            return 'early'
+        return 'long'
+
+    def sent(self, kind: str):
+        metrics[f'ring_sends_{kind}'] += 1
+        if kind == 'first':
+            self._first_sends[int(clock.monotonic())] += 1
+
+    def saturated(self, retry_after: float):
+        """Учитывает ответ 429: Telegram просит подождать retry_after секунд"""
+        now = clock.monotonic()
+        metrics['ring_retry_after'] += 1
+        observe('ring_retry_after_seconds', retry_after)
+        if self._saturated_until is None or now >= self._saturated_until:
+            logger.warning("Telegram ограничил отправку (429), повтор через %.0f с", retry_after)
+        self._saturated_until = max(self._saturated_until or now, now + retry_after)
+        # Пересчитываем растяжение сразу, не дожидаясь RECOMPUTE_INTERVAL
+        self._computed_at = None
+
+    def interval(self, kind: str) -> float:
+        """Сколько ждать до следующего сообщения звонка после сообщения класса kind"""
+        self._recompute()
+        if kind == 'long':
+            return RING_INTERVAL * self.stretch
+        return RING_INTERVAL
+
+    def _recompute(self):
+        now = clock.monotonic()
+        if self._computed_at is not None and now - self._computed_at < self.RECOMPUTE_INTERVAL:
+            return
+        elapsed = now - self._computed_at if self._computed_at is not None else 0.0
+        self._computed_at = now
+        
+        second = int(now)
+        for old in [s for s in self._first_sends if s < second - 1]:
+            del self._first_sends[old]
+        first_demand = max(self._first_sends[second - 1], self._first_sends[second], self.pending_first)
+        early = long = 0
+        for session in ringing_sessions.values():
+            if session.ticks == 0:
+                continue
+            if now - session.started < self.long_after:
+                early += 1
+            else:
+                long += 1
+        early_demand = early / RING_INTERVAL
+        long_demand = long / RING_INTERVAL
+        
+        # Долгим звонкам достается то, что осталось после первых сообщений и ранних повторов
+        available = self.rate - first_demand - early_demand
+        if long == 0:
+            stretch = 1.0
+        elif self._saturated_until is not None and now < self._saturated_until:
+            # Лимит Telegram ниже расчетного: освобождаем все, что можно
+            stretch = self.max_stretch
+        elif long_demand <= available:
+            stretch = 1.0
+        else:
+            stretch = min(self.max_stretch, long_demand / max(available, 1e-9))
+        demand = first_demand + early_demand + long_demand / stretch
+        
+        if stretch > 1.0:
+            if self._degraded_since is None:
+                self._degraded_since = now
+                metrics['ring_degradations'] += 1
+                logger.warning(
+                    "Исходящие сообщения на пределе: спрос %.1f/с при лимите %.0f/с, "
+                    "интервал %d долгих звонков увеличен в %.1f раза",
+                    first_demand + early_demand + long_demand, self.rate, long, stretch
+                )
+            else:
+                metrics['ring_degraded_seconds'] += elapsed
+            observe('ring_stretch', stretch)
+        elif self._degraded_since is not None:
+            logger.info("Перегрузка исходящих сообщений закончилась через %.0f с", now - self._degraded_since)
+            self._degraded_since = None
+        if demand > self.rate:
+            # Даже максимальное растяжение долгих звонков не освобождает достаточно
+            metrics['ring_overload_unresolved'] += 1
+        metrics['ring_stretch'] = stretch
+        self.stretch = stretch
+
+# Приоритеты исходящих сообщений звонков
+ring_governor = RingGovernor()
+
+# Функция отправки спам-сообщений
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Пауза из ответа 429 в секундах: PTB отдает int или timedelta (PTB_TIMEDELTA)"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+async def spam_messages(app: Application, session: RingingSession):
+    """Отправляет спам-сообщения каждые 2 секунды пока флаг активен
+
+    В записи трассы будильников звонка дописываются момент первой отправки,
+    число сообщений и момент остановки.
+    """
+    user_id = session.user_id
+    spam_active[user_id] = True
+    outcome = 'stopped'
+    utc = get_zone('UTC')
+    
+    retry_after = 0.0
+    
+    try:
+        while spam_active.get(user_id, False):
+            try:
+                if retry_after:
+                    # Telegram попросил подождать (429): ждем и проверяем, не остановлен ли звонок
+                    await clock.sleep(retry_after)
+                    retry_after = 0.0
+                    continue
+                kind = ring_governor.classify(session)
+                await app.bot.send_message(chat_id=user_id, text=session.render())
+                connection_warmer.touch()
+                ring_governor.sent(kind)
+                session.ticks += 1
+                if session.ticks == 1 or session.traces:
+                    sent_at = clock.now(utc)
+                    if session.ticks == 1:
+                        observe('first_send_lateness_seconds', (sent_at - session.prepared.planned_utc).total_seconds())
+                    for trace in session.traces:
+                        trace['ticks'] += 1
+                        if trace['first_sent'] is None:
+                            trace['first_sent'] = sent_at.timestamp()
+                # Каждое сообщение не логируем: оно попадает в периодическую сводку
+                ring_log_stats['sent'] += 1
+                ring_log_users.add(user_id)
+                logger.debug("Будильник отправлен пользователю %s", user_id)
+                
+                # Ждем перед следующим сообщением (при перегрузке долгие звонки ждут дольше)
+                await clock.sleep(ring_governor.interval(kind))
+                
+            except asyncio.CancelledError:
+                logger.info("Спам отменен для пользователя %s", user_id)
+                outcome = 'cancelled'
+                break
+            except RetryAfter as e:
+                # Перегрузка, а не ошибка: ждем и продолжаем будить пользователя
+                retry_after = retry_after_seconds(e)
+                ring_log_stats['retry_after'] += 1
+                ring_governor.saturated(retry_after)
+            except Exception as e:
+                ring_log_stats['errors'] += 1
+                logger.error("Ошибка при отправке будильника: %s", e)
+                outcome = 'error'
+                break
+    finally:
+        if ringing_sessions.get(user_id) is session:
+            del ringing_sessions[user_id]
+        stopped = clock.now(utc).timestamp()
+        for trace in session.traces:
+            trace['stopped'] = stopped
+            trace['outcome'] = outcome
+            fire_trace.record(trace)
 
-# Функция отправки спам-сообщений
-async def spam_messages(app: Application, user_id: int, alarm_time: datetime, message: str):
-    """Отправляет спам-сообщения каждые 2 секунды пока флаг активен"""
-    spam_active[user_id] = True
+# Функция перепланирования будильников пользователя
+def reschedule_user_alarms(user_id: int) -> int:
+    """Пересчитывает моменты срабатывания ожидающих будильников пользователя
+    (например, после смены часового пояса)
+
+    Задачи не пересоздаются: у каждой переносится момент пробуждения,
+    будильники других пользователей не затрагиваются. Возвращает число
+    перенесенных будильников.
+    """
+    alarms = scheduled_alarms.get(user_id)
+    if not alarms:
+        return 0
     
-    while spam_active.get(user_id, False):
-        try:
-            # Получаем текущее время в часовом поясе пользователя
-            current_time = get_user_datetime_now(user_id).strftime("%H:%M:%S")
-            alarm_text = f"⏰ БУДИЛЬНИК! Время: {alarm_time.strftime('%H:%M')}\n🕐 Сейчас: {current_time}"
-            if message:
-                alarm_text += f"\n💬 {message}"
-            alarm_text += "\n\n❌ Напишите 'стоп' чтобы остановить"
-            
-            await app.bot.send_message(chat_id=user_id, text=alarm_text)
-            logger.info(f"Будильник отправлен пользователю {user_id}")
-            
-            # Ждем 2 секунды перед следующим сообщением
-            await asyncio.sleep(2)
-            
-        except asyncio.CancelledError:
-            logger.info(f"Спам отменен для пользователя {user_id}")
-            break
-        except Exception as e:
-            logger.error(f"Ошибка при отправке будильника: {e}")
-            break
+    now = get_user_datetime_now(user_id)
+    utc = get_zone('UTC')
+    for alarm in alarms:
+        alarm.move(compute_alarm_target(now, alarm.alarm_time, alarm.repeat_days).astimezone(utc))
+    metrics['alarms_rescheduled'] += len(alarms)
+    logger.info("Будильники пользователя %s перепланированы: %d", user_id, len(alarms))
+    return len(alarms)
+
+def wake_scheduled_alarms() -> int:
+    """Прерывает сон всех ожидающих будильников, чтобы они заново сверились
+    с системными часами (после скачка времени). Возвращает их число"""
+    count = 0
+    for alarms in scheduled_alarms.values():
+        for alarm in alarms:
+            alarm.move(alarm.target_utc)
+            count += 1
+    return count
 
 # Функция отправки будильника
-async def send_alarm(app: Application, user_id: int, alarm_time: datetime, message: str, delay: float, repeat_days: Optional[Set[int]] = None):
+async def send_alarm(app: Application, alarm: ScheduledAlarm):
     """Ждет указанное время и запускает спам"""
+    user_id = alarm.user_id
+    alarm_time = alarm.alarm_time
+    message = alarm.message
+    repeat_days = alarm.repeat_days
+    alarm_id = alarm.alarm_id
     try:
-        # Ждем до наступления времени будильника
-        await asyncio.sleep(delay)
-        
-        # Устанавливаем флаг активности
-        spam_active[user_id] = True
+        prepared = None
+        reserved = False
+        try:
+            if PREWARM_LEAD > 0:
+                utc = get_zone('UTC')
+                while True:
+                    # Просыпаемся заранее и готовим все, что не зависит от точного момента
+                    await clock.sleep_until(alarm, PREWARM_LEAD)
+                    ring_governor.pending_first += 1
+                    reserved = True
+                    observe('prewarm_lead_seconds', max((alarm.target_utc - clock.now(utc)).total_seconds(), 0.0))
+                    started = time.perf_counter()
+                    prepared = await prepare_alarm(app, alarm)
+                    observe('prewarm_seconds', time.perf_counter() - started)
+                    # Ждем момента будильника, пока его не перенесли за пределы окна прогрева
+                    while 0 < (remaining := (alarm.target_utc - clock.now(utc)).total_seconds()) <= PREWARM_LEAD:
+                        await clock.sleep(min(remaining, MAX_SLEEP_CHUNK), alarm)
+                    if remaining <= 0:
+                        lateness = -remaining
+                        break
+                    # Будильник перенесли дальше: первая отправка больше не ожидается, резерв вернется при следующем прогреве
+                    ring_governor.pending_first -= 1
+                    reserved = False
+                    metrics['prewarm_reservations_released'] += 1
+            else:
+                # Ждем до наступления времени будильника (момент может быть перенесен)
+                lateness = await clock.sleep_until(alarm)
+        finally:
+            if reserved:
+                ring_governor.pending_first -= 1
+            user_alarms = scheduled_alarms.get(user_id)
+            if user_alarms is not None:
+                user_alarms.discard(alarm)
+                if not user_alarms:
+                    del scheduled_alarms[user_id]
+        observe('fire_lateness_seconds', lateness)
+        if prepared is None or prepared.planned_utc != alarm.target_utc:
+            # Прогрева не было или будильник перенесли во время него
+            prepared = await prepare_alarm(app, alarm, warm=False)
         
-        # Запускаем спам
-        task = asyncio.create_task(
-            spam_messages(app, user_id, alarm_time, message)
-        )
+        # Запись трассы: запланированный момент и момент запуска (UTC, секунды эпохи)
+        trace = None
+        if fire_trace.enabled:
+            trace = {
+                'user_id': user_id,
+                'tz': str(prepared.zone),
+                'alarm_time': alarm_time.strftime("%H:%M"),
+                'recurring': bool(repeat_days),
+                'planned': alarm.target_utc.timestamp(),
+                'dispatched': clock.now(get_zone('UTC')).timestamp(),
+                'first_sent': None,
+                'ticks': 0,
+            }
         
-        # Сохраняем задачу
-        if user_id not in active_alarms:
-            active_alarms[user_id] = []
-        active_alarms[user_id].append(task)
+        session = ringing_sessions.get(user_id)
+        if session is not None and spam_active.get(user_id) and not session.task.done():
+            # Пользователю уже звонят: будильник добавляется в идущий звонок
+            session.add(alarm_time, message, trace)
+            metrics['ringing_sessions_merged'] += 1
+        else:
+            if session is not None:
+                # Остановленный звонок еще не успел завершиться
+                session.task.cancel()
+            session = RingingSession(user_id, prepared)
+            session.add(alarm_time, message, trace)
+            ringing_sessions[user_id] = session
+            
+            # Устанавливаем флаг активности и запускаем спам
+            spam_active[user_id] = True
+            session.task = asyncio.create_task(spam_messages(app, session))
+            
+            # Сохраняем задачу
+            if user_id not in active_alarms:
+                active_alarms[user_id] = []
+            active_alarms[user_id].append(session.task)
         
         # Если это повторяющийся будильник, планируем следующий раз
         if repeat_days:
-            await schedule_alarm(app, user_id, alarm_time, message, repeat_days)
+            await schedule_alarm(app, user_id, alarm_time, message, repeat_days, alarm_id, after=alarm.target_utc)
+        elif alarm_id is not None:
+            # Одноразовый будильник больше не нужен: строку удалит фоновое обслуживание БД
+            storage.mark_fired(user_id, alarm_id, alarm.target_utc.isoformat())
         
     except asyncio.CancelledError:
-        logger.info(f"Будильник отменен для пользователя {user_id}")
+        logger.info("Будильник отменен для пользователя %s", user_id)
         spam_active[user_id] = False
     except Exception as e:
-        logger.error(f"Ошибка при отправке будильника: {e}")
+        logger.error("Ошибка при отправке будильника: %s", e)
+
+# Путь к Unix-сокету отдельного процесса движка будильников (пусто - движок работает в процессе бота)
+ENGINE_SOCKET = os.getenv('ENGINE_SOCKET', '')
+# Как часто лидер проверяет связь с процессом движка (секунды)
+ENGINE_HEARTBEAT_INTERVAL = float(os.getenv('ENGINE_HEARTBEAT_INTERVAL', '2'))
+
+class EngineError(RuntimeError):
+    """Движок будильников недоступен или отклонил команду"""
+
+class AlarmEngine:
+    """Движок будильников в процессе бота: таймеры и звонки живут в его event loop
+
+    Обработчики команд управляют будильниками только через движок, поэтому
+    его можно вынести в отдельный процесс (см. RemoteEngine).
+    """
+
+    def __init__(self, app: Optional[Application] = None):
+        self.app = app
+
+    async def ping(self) -> bool:
+        """Проверка связи"""
+        return True
+
+    async def active(self, user_id: int) -> bool:
+        """Есть ли у пользователя запланированные или звонящие будильники"""
+        return bool(active_alarms.get(user_id))
+
+    async def cancel(self, user_id: int) -> None:
+        """Останавливает звонок и снимает все будильники пользователя"""
+        spam_active[user_id] = False
+        for task in active_alarms.get(user_id, []):
+            task.cancel()
+        active_alarms[user_id] = []
+
+    async def schedule(self, user_id: int, alarm_time: datetime, message: str = "", repeat_days: Optional[Set[int]] = None, alarm_id: Optional[int] = None) -> None:
+        await schedule_alarm(self.app, user_id, alarm_time, message, repeat_days, alarm_id)
+
+    async def reschedule(self, user_id: int) -> int:
+        """Переносит ожидающие будильники пользователя (после смены часового пояса)"""
+        return reschedule_user_alarms(user_id)
+
+    async def load(self) -> None:
+        """Снимает все будильники и планирует сохраненные в БД заново"""
+        await self.reset()
+        await load_saved_alarms(self.app)
+
+    async def reset(self) -> None:
+        """Снимает все будильники"""
+        for tasks in active_alarms.values():
+            for task in tasks:
+                task.cancel()
+        active_alarms.clear()
+        spam_active.clear()
+        scheduled_alarms.clear()
+        ringing_sessions.clear()
+
+class RemoteEngine(AlarmEngine):
+    """Клиент движка, работающего в отдельном процессе (python bot.py engine)
+
+    Команды передаются строками JSON через Unix-сокет, на каждую приходит
+    ответ. Всплеск команд пользователей нагружает только процесс бота, а
+    будильники звонят из event loop движка. Если соединение потеряно,
+    клиент переподключается и, если будильники уже были загружены,
+    заново синхронизирует движок с БД.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+        self._loaded = False
+
+    async def _request(self, op: str, params: dict):
+        self._writer.write(json.dumps({'op': op, **params}).encode() + b'\n')
+        await self._writer.drain()
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("движок закрыл соединение")
+        return json.loads(line)
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _call(self, op: str, **params):
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                        if self._loaded and op != 'load':
+                            # Движок мог перезапуститься: синхронизируем его с БД
+                            await self._request('load', {})
+                    reply = await self._request(op, params)
+                    break
+                except OSError as e:
+                    self._disconnect()
+                    metrics['engine_reconnects'] += 1
+                    if attempt:
+                        raise EngineError(f"Движок будильников недоступен: {e}") from e
+        if not reply.get('ok'):
+            raise EngineError(reply.get('error'))
+        return reply.get('result')
+
+    async def ping(self) -> bool:
+        return await self._call('ping')
+
+    async def active(self, user_id: int) -> bool:
+        return await self._call('active', user_id=user_id)
+
+    async def cancel(self, user_id: int) -> None:
+        await self._call('cancel', user_id=user_id)
+
+    async def schedule(self, user_id: int, alarm_time: datetime, message: str = "", repeat_days: Optional[Set[int]] = None, alarm_id: Optional[int] = None) -> None:
+        await self._call(
+            'schedule', user_id=user_id, alarm_time=alarm_time.strftime("%H:%M"), message=message,
+            repeat_days=sorted(repeat_days) if repeat_days is not None else None, alarm_id=alarm_id
+        )
+
+    async def reschedule(self, user_id: int) -> int:
+        return await self._call('reschedule', user_id=user_id)
+
+    async def load(self) -> None:
+        await self._call('load')
+        self._loaded = True
+
+    async def reset(self) -> None:
+        self._loaded = False
+        await self._call('reset')
+
+async def engine_heartbeat(interval: float = ENGINE_HEARTBEAT_INTERVAL):
+    """Раз в interval секунд проверяет связь с процессом движка
+
+    Запрос к перезапущенному движку переподключает клиента, и тот сразу
+    загружает в движок будильники из БД, не дожидаясь команды пользователя.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await engine.ping()
+        except EngineError as e:
+            logger.warning("Движок будильников не отвечает: %s", e)
+
+def create_engine() -> AlarmEngine:
+    """Создает движок по настройкам окружения"""
+    if ENGINE_SOCKET:
+        return RemoteEngine(ENGINE_SOCKET)
+    return AlarmEngine()
+
+# Движок будильников процесса бота (приложение подставляется в main)
+engine: AlarmEngine = create_engine()
+
+async def reply_engine_unavailable(update: Update, saved: Optional[str] = None):
+    """Сообщает, что движок будильников недоступен
+
+    saved - что команда уже успела записать в БД: движок подхватит это сам,
+    когда снова станет доступен.
+    """
+    metrics['engine_unavailable_replies'] += 1
+    if saved:
+        text = (f"⚠️ **{saved}**, но сервис будильников сейчас недоступен.\n\n"
+                "Изменения вступят в силу автоматически, как только он восстановится.")
+    else:
+        text = "⚠️ **Сервис будильников сейчас недоступен.**\n\nПопробуйте еще раз через минуту."
+    await update.effective_message.reply_text(text, parse_mode="Markdown")
+
+def reports_engine_errors(handler):
+    """Декоратор обработчиков, работающих с движком: если он недоступен,
+    пользователь получает ответ вместо молчаливой ошибки"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            return await handler(update, context)
+        except EngineError as e:
+            logger.error("Движок будильников недоступен при обработке команды: %s", e)
+            await reply_engine_unavailable(update)
+    return wrapper
+
+# Функции разбора аргументов команд
+def parse_alarm_time(time_str: str) -> datetime:
+    """Разбирает время будильника (HH:MM, HH.MM или "HH MM")"""
+    formats_to_try = ["%H:%M", "%H.%M", "%H %M"]
+    
+    for fmt in formats_to_try:
+        try:
+            return datetime.strptime(time_str, fmt)
+        except ValueError:
+            continue
+    
+    raise ValueError(f"Неверный формат времени: {time_str}. Используйте HH:MM (например, 08:30 или 8:30)")
+
+def parse_repeat_days(days_str: str) -> Set[int]:
+    """Разбирает дни недели в формате 1-7 и возвращает их в формате 0-6 (Python weekday)"""
+    repeat_days_set = set()
+    for day_char in days_str:
+        if day_char.isdigit():
+            day_num = int(day_char)
+            if 1 <= day_num <= 7:
+                # Конвертируем: 1(Пн)=0, 2(Вт)=1, ..., 7(Вс)=6
+                repeat_days_set.add(day_num - 1)
+    
+    if not repeat_days_set:
+        raise ValueError("Неверный формат дней недели")
+    return repeat_days_set
 
 # Обработчик команды /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -263,6 +1810,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 # Обработчик команды /set
+@throttled
+@reports_engine_errors
 async def set_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Устанавливает одноразовый будильник"""
     if not context.args:
@@ -300,47 +1849,30 @@ async def set_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         time_str = context.args[0].strip()
         
         # Проверяем и парсим формат времени
-        alarm_time = None
-        formats_to_try = ["%H:%M", "%H.%M", "%H %M"]
-        
-        for fmt in formats_to_try:
-            try:
-                alarm_time = datetime.strptime(time_str, fmt)
-                break
-            except ValueError:
-                continue
-        
-        if alarm_time is None:
-            raise ValueError(f"Неверный формат времени: {time_str}. Используйте HH:MM (например, 08:30 или 8:30)")
+        alarm_time = parse_alarm_time(time_str)
         
         # Получаем сообщение, если есть
         message = " ".join(context.args[1:]) if len(context.args) > 1 else ""
         
-        # Отменяем предыдущие будильники для пользователя
-        if user_id in active_alarms:
-            for task in active_alarms[user_id]:
-                task.cancel()
-            active_alarms[user_id] = []
+        # Новый одноразовый заменяет старый, поэтому считаем только повторяющиеся
+        if storage.count_alarms(user_id, recurring_only=True) + 1 > MAX_ALARMS_PER_USER:
+            await reply_alarm_limit(update)
+            return
         
-        # Отменяем флаг спама если был установлен
-        spam_active[user_id] = False
+        # Отменяем предыдущие будильники пользователя и звонок, если он идет
+        await engine.cancel(user_id)
         
-        # Планируем новый будильник (одноразовый, без repeat_days)
-        await schedule_alarm(context.application, user_id, alarm_time, message, None)
-        
-        # Сохраняем в БД
-        conn = sqlite3.connect('alarms.db')
-        cursor = conn.cursor()
-        # Удаляем старые будильники пользователя (только одноразовые)
-        cursor.execute('DELETE FROM alarms WHERE user_id = ? AND (repeat_days IS NULL OR repeat_days = "")', (user_id,))
-        # Добавляем новый
+        # Сохраняем в БД (старые одноразовые будильники заменяются новым)
         now_user = get_user_datetime_now(user_id)
-        cursor.execute(
-            'INSERT INTO alarms (user_id, alarm_time, message, created_at, repeat_days) VALUES (?, ?, ?, ?, ?)',
-            (user_id, alarm_time.strftime("%H:%M"), message, now_user.isoformat(), None)
-        )
-        conn.commit()
-        conn.close()
+        alarm_id = storage.replace_one_time_alarm(user_id, alarm_time.strftime("%H:%M"), message, now_user.isoformat())
+        
+        # Планируем новый будильник (одноразовый, без repeat_days)
+        try:
+            await engine.schedule(user_id, alarm_time, message, None, alarm_id)
+        except EngineError as e:
+            logger.error("Будильник сохранен, но движок недоступен: %s", e)
+            await reply_engine_unavailable(update, "Будильник сохранен")
+            return
         
         # Вычисляем время до будильника в часовом поясе пользователя
         now = get_user_datetime_now(user_id)
@@ -406,6 +1938,8 @@ async def set_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
 # Обработчик команды /repeat
+@throttled
+@reports_engine_errors
 async def set_repeat_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Устанавливает повторяющийся будильник"""
     if not context.args or len(context.args) < 2:
@@ -451,55 +1985,32 @@ async def set_repeat_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         time_str = context.args[0].strip()
         
         # Проверяем и парсим формат времени
-        alarm_time = None
-        formats_to_try = ["%H:%M", "%H.%M", "%H %M"]
-        
-        for fmt in formats_to_try:
-            try:
-                alarm_time = datetime.strptime(time_str, fmt)
-                break
-            except ValueError:
-                continue
-        
-        if alarm_time is None:
-            raise ValueError(f"Неверный формат времени: {time_str}. Используйте HH:MM (например, 08:30 или 8:30)")
+        alarm_time = parse_alarm_time(time_str)
         
         # Парсим дни недели
-        days_str = context.args[1]
-        # Преобразуем из формата 1-7 в 0-6 (Python weekday)
-        repeat_days_set = set()
-        for day_char in days_str:
-            if day_char.isdigit():
-                day_num = int(day_char)
-                if 1 <= day_num <= 7:
-                    # Конвертируем: 1(Пн)=0, 2(Вт)=1, ..., 7(Вс)=6
-                    repeat_days_set.add(day_num - 1)
-        
-        if not repeat_days_set:
-            raise ValueError("Неверный формат дней недели")
+        repeat_days_set = parse_repeat_days(context.args[1])
         
         # Получаем сообщение, если есть
         message = " ".join(context.args[2:]) if len(context.args) > 2 else ""
         
-        # Планируем новый будильник
-        await schedule_alarm(context.application, user_id, alarm_time, message, repeat_days_set)
-        
-        # Сохраняем в БД
-        conn = sqlite3.connect('alarms.db')
-        cursor = conn.cursor()
-        # Удаляем старые повторяющиеся будильники пользователя (с таким же временем)
-        cursor.execute(
-            'DELETE FROM alarms WHERE user_id = ? AND alarm_time = ? AND repeat_days IS NOT NULL AND repeat_days != ""',
-            (user_id, alarm_time.strftime("%H:%M"))
-        )
-        # Добавляем новый
+        # Повторяющийся будильник с тем же временем будет заменен, его не считаем
+        if storage.count_alarms(user_id, exclude_recurring_time=alarm_time.strftime("%H:%M")) + 1 > MAX_ALARMS_PER_USER:
+            await reply_alarm_limit(update)
+            return
+        
+        # Сохраняем в БД (повторяющийся будильник с таким же временем заменяется новым)
         now_user = get_user_datetime_now(user_id)
-        cursor.execute(
-            'INSERT INTO alarms (user_id, alarm_time, message, created_at, repeat_days) VALUES (?, ?, ?, ?, ?)',
-            (user_id, alarm_time.strftime("%H:%M"), message, now_user.isoformat(), json.dumps(list(repeat_days_set)))
+        alarm_id = storage.replace_recurring_alarm(
+            user_id, alarm_time.strftime("%H:%M"), message, now_user.isoformat(), json.dumps(list(repeat_days_set))
         )
-        conn.commit()
-        conn.close()
+        
+        # Планируем новый будильник
+        try:
+            await engine.schedule(user_id, alarm_time, message, repeat_days_set, alarm_id)
+        except EngineError as e:
+            logger.error("Будильник сохранен, но движок недоступен: %s", e)
+            await reply_engine_unavailable(update, "Будильник сохранен")
+            return
         
         # Вычисляем время до будильника в часовом поясе пользователя
         now = get_user_datetime_now(user_id)
@@ -579,42 +2090,32 @@ async def set_repeat_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
 # Обработчик команды /stop
+@reports_engine_errors
 async def stop_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Останавливает все будильники"""
     user_id = update.effective_user.id
     
-    if user_id not in active_alarms or not active_alarms[user_id]:
+    if not await engine.active(user_id):
         await update.message.reply_text("⏸ Вы не установили ни одного будильника.")
         return
     
-    # Останавливаем спам
-    spam_active[user_id] = False
-    
-    # Отменяем все задачи
-    for task in active_alarms[user_id]:
-        task.cancel()
+    # Останавливаем спам и отменяем все задачи
+    await engine.cancel(user_id)
     
     # Получаем повторяющиеся будильники из БД перед удалением
-    conn = sqlite3.connect('alarms.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT alarm_time, message, repeat_days FROM alarms WHERE user_id = ? AND repeat_days IS NOT NULL AND repeat_days != ""', (user_id,))
-    recurring_alarms = cursor.fetchall()
+    recurring_alarms = storage.get_recurring_alarms(user_id)
     
     # Удаляем из БД только одноразовые будильники
-    cursor.execute('DELETE FROM alarms WHERE user_id = ? AND (repeat_days IS NULL OR repeat_days = "")', (user_id,))
-    conn.commit()
-    conn.close()
-    
-    active_alarms[user_id] = []
+    storage.delete_one_time_alarms(user_id)
     
     # Перепланируем повторяющиеся будильники
     for alarm_time, message, repeat_days in recurring_alarms:
         try:
             alarm_datetime = datetime.strptime(alarm_time, "%H:%M")
             repeat_days_set = set(json.loads(repeat_days)) if repeat_days else None
-            await schedule_alarm(context.application, user_id, alarm_datetime, message or "", repeat_days_set)
+            await engine.schedule(user_id, alarm_datetime, message or "", repeat_days_set)
         except Exception as e:
-            logger.error(f"Ошибка при перепланировании повторяющегося будильника: {e}")
+            logger.error("Ошибка при перепланировании повторяющегося будильника: %s", e)
     
     keyboard = [
         [InlineKeyboardButton("⏰ Установить новый", callback_data="set_alarm")],
@@ -658,11 +2159,7 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Проверяем БД
-    conn = sqlite3.connect('alarms.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT alarm_time, message, repeat_days FROM alarms WHERE user_id = ?', (user_id,))
-    alarms = cursor.fetchall()
-    conn.close()
+    alarms = storage.get_alarms(user_id)
     
     if not alarms:
         await update.message.reply_text("📭 У вас нет установленных будильников.")
@@ -684,6 +2181,8 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(status_text, parse_mode="Markdown")
 
 # Обработчик команды /timezone
+@throttled
+@reports_engine_errors
 async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Устанавливает часовой пояс пользователя"""
     user_id = update.effective_user.id
@@ -714,6 +2213,13 @@ async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Проверяем валидность часового пояса
     if set_user_timezone(user_id, timezone_str):
+        # Уже запланированные будильники должны сработать по новому часовому поясу
+        try:
+            await engine.reschedule(user_id)
+        except EngineError as e:
+            logger.error("Часовой пояс сохранен, но движок недоступен: %s", e)
+            await reply_engine_unavailable(update, "Часовой пояс сохранен")
+            return
         current_time = get_user_datetime_now(user_id).strftime("%H:%M:%S")
         await update.message.reply_text(
             f"✅ **Часовой пояс установлен!**\n\n"
@@ -737,15 +2243,19 @@ async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="Markdown"
         )
 
+# Слова, которыми можно остановить будильник
+STOP_WORDS = ("стоп", "stop", "остановить", "stop all")
+
 # Обработчик текстовых сообщений (для команды "стоп")
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает текстовые сообщения"""
     text = update.message.text.lower().strip()
     
-    if text in ["стоп", "stop", "остановить", "stop all"]:
+    if text in STOP_WORDS:
         await stop_alarm(update, context)
 
 # Обработчик кнопок (callback query)
+@reports_engine_errors
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает нажатия на inline-кнопки"""
     query = update.callback_query
@@ -887,11 +2397,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
         # Проверяем БД
-        conn = sqlite3.connect('alarms.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT alarm_time, message, repeat_days FROM alarms WHERE user_id = ?', (user_id,))
-        alarms = cursor.fetchall()
-        conn.close()
+        alarms = storage.get_alarms(user_id)
         
         if not alarms:
             await query.edit_message_text(
@@ -921,7 +2427,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif query.data == "stop":
         user_id = update.effective_user.id
         
-        if user_id not in active_alarms or not active_alarms[user_id]:
+        if not await engine.active(user_id):
             await query.edit_message_text(
                 "⏸ **Нет активных будильников**\n\n"
                 "Используйте `/set HH:MM` для установки",
@@ -929,34 +2435,23 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Останавливаем спам
-        spam_active[user_id] = False
-        
-        # Отменяем все задачи
-        for task in active_alarms[user_id]:
-            task.cancel()
+        # Останавливаем спам и отменяем все задачи
+        await engine.cancel(user_id)
         
         # Получаем повторяющиеся будильники из БД перед удалением
-        conn = sqlite3.connect('alarms.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT alarm_time, message, repeat_days FROM alarms WHERE user_id = ? AND repeat_days IS NOT NULL AND repeat_days != ""', (user_id,))
-        recurring_alarms = cursor.fetchall()
+        recurring_alarms = storage.get_recurring_alarms(user_id)
         
         # Удаляем из БД только одноразовые будильники
-        cursor.execute('DELETE FROM alarms WHERE user_id = ? AND (repeat_days IS NULL OR repeat_days = "")', (user_id,))
-        conn.commit()
-        conn.close()
-        
-        active_alarms[user_id] = []
+        storage.delete_one_time_alarms(user_id)
         
         # Перепланируем повторяющиеся будильники
         for alarm_time, message, repeat_days in recurring_alarms:
             try:
                 alarm_datetime = datetime.strptime(alarm_time, "%H:%M")
                 repeat_days_set = set(json.loads(repeat_days)) if repeat_days else None
-                await schedule_alarm(context.application, user_id, alarm_datetime, message or "", repeat_days_set)
+                await engine.schedule(user_id, alarm_datetime, message or "", repeat_days_set)
             except Exception as e:
-                logger.error(f"Ошибка при перепланировании повторяющегося будильника: {e}")
+                logger.error("Ошибка при перепланировании повторяющегося будильника: %s", e)
         
         if recurring_alarms:
             await query.edit_message_text(
@@ -972,8 +2467,652 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode="Markdown"
             )
 
+# Обработчик команды /stats (только для администраторов)
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает служебные счетчики"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    lines = [f"`{name}`: {value:g}" for name, value in sorted(metrics.items())]
+    await update.message.reply_text(
+        "📈 **Счетчики:**\n\n" + ("\n".join(lines) or "пока пусто"),
+        parse_mode="Markdown"
+    )
+
+# Идет ли сейчас профилирование (одновременно допускается только одно)
+profiling_active = False
+
+def write_profile_reports(profiler: cProfile.Profile, memory_diff: list, seconds: float, path_base: str) -> Tuple[str, str]:
+    """Сохраняет профиль в формате pstats и текстовый отчет с горячими точками и ростом памяти"""
+    os.makedirs(os.path.dirname(path_base) or '.', exist_ok=True)
+    pstats_path = f"{path_base}.pstats"
+    report_path = f"{path_base}.txt"
+    profiler.dump_stats(pstats_path)
+    
+    report = io.StringIO()
+    report.write(f"Профиль за {seconds:g} с\n\n=== CPU: по собственному времени ===\n")
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(40)
+    report.write("\n=== CPU: по суммарному времени ===\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(40)
+    report.write("\n=== Память: прирост за время профилирования (tracemalloc) ===\n")
+    for stat in memory_diff[:40]:
+        report.write(f"{stat}\n")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write(report.getvalue())
+    return pstats_path, report_path
+
+async def capture_profile(seconds: float) -> Tuple[str, str]:
+    """Профилирует работающий процесс seconds секунд
+
+    cProfile включается в потоке event loop, поэтому видит все обработчики
+    и циклы звонков. Параллельно снимаются два снимка tracemalloc, в отчет
+    попадает их разница. Возвращает пути к файлам .pstats и .txt.
+    """
+    global profiling_active
+    if profiling_active:
+        raise RuntimeError("Профилирование уже идет")
+    profiling_active = True
+    
+    started_tracemalloc = not tracemalloc.is_tracing()
+    try:
+        if started_tracemalloc:
+            tracemalloc.start(10)
+        snapshot_before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        logger.info("Профилирование запущено на %g с", seconds)
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        snapshot_after = tracemalloc.take_snapshot()
+    finally:
+        if started_tracemalloc:
+            tracemalloc.stop()
+        profiling_active = False
+    
+    # Сравнение снимков и запись файлов - в отдельном потоке, чтобы не задерживать будильники
+    path_base = os.path.join(PROFILE_DIR, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+    memory_diff = await asyncio.to_thread(snapshot_after.compare_to, snapshot_before, 'lineno')
+    paths = await asyncio.to_thread(write_profile_reports, profiler, memory_diff, seconds, path_base)
+    metrics['profiles_captured'] += 1
+    logger.info("Профилирование завершено, отчеты: %s", ", ".join(paths))
+    return paths
+
+def start_profile_from_signal():
+    """Обработчик SIGUSR2: профилирует PROFILE_DEFAULT_SECONDS секунд"""
+    async def run():
+        try:
+            await capture_profile(PROFILE_DEFAULT_SECONDS)
+        except RuntimeError as e:
+            logger.warning("%s", e)
+    background_tasks.append(asyncio.create_task(run()))
+
+# Обработчик команды /profile (только для администраторов)
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Снимает профиль CPU и памяти и присылает отчеты файлами"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    try:
+        seconds = float(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await update.message.reply_text("Используйте: `/profile [секунды]`", parse_mode="Markdown")
+        return
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+    
+    await update.message.reply_text(f"⏱ Профилирую {seconds:g} с...")
+    try:
+        paths = await capture_profile(seconds)
+    except RuntimeError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    
+    for path in paths:
+        with open(path, 'rb') as f:
+            await update.message.reply_document(f, filename=os.path.basename(path))
+
+class LoopWatchdog:
+    """Следит за задержками event loop и ловит блокирующие вызовы
+
+    Задача в loop раз в LOOP_LAG_INTERVAL обновляет метку времени и замеряет,
+    насколько позже положенного она проснулась. Отдельный поток проверяет
+    метку: если loop не отвечает дольше порога, он снимает стек потока loop
+    (то есть код, который блокирует его прямо сейчас), пишет его в лог
+    и увеличивает счетчик зависаний. Заодно задача сравнивает ход системных
+    и монотонных часов и сообщает о скачках времени.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stall_reported = False
+        self._stopped = threading.Event()
+
+    def start(self, debug: bool = LOOP_DEBUG) -> asyncio.Task:
+        """Запускает сторож; вызывается из потока event loop"""
+        loop = asyncio.get_running_loop()
+        if debug:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+            logging.getLogger('asyncio').setLevel(logging.WARNING)
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+        return asyncio.create_task(self._measure_lag())
+
+    def stop(self):
+        self._stopped.set()
+
+    async def _measure_lag(self):
+        try:
+            while True:
+                started = time.monotonic()
+                wall_started = time.time()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                lag = now - started - self.interval
+                observe('loop_lag_seconds', max(lag, 0.0))
+                # Разница хода системных и монотонных часов - это скачок времени (NTP, пробуждение ВМ)
+                drift = time.time() - wall_started - (now - started)
+                if abs(drift) >= CLOCK_DRIFT_THRESHOLD:
+                    metrics['clock_drift_corrections'] += 1
+                    observe('clock_drift_abs_seconds', abs(drift))
+                    woken = wake_scheduled_alarms()
+                    logger.warning("Обнаружен скачок системного времени на %.3f с, ожидание %d будильников пересчитано", drift, woken)
+                if self._stall_reported:
+                    logger.warning("Event loop снова отвечает, задержка составила %.3f с", lag)
+                    self._stall_reported = False
+                self._heartbeat = now
+        finally:
+            self.stop()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2):
+            silence = time.monotonic() - self._heartbeat - self.interval
+            if silence < self.threshold or self._stall_reported:
+                continue
+            self._stall_reported = True
+            metrics['loop_stalls'] += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else 'стек недоступен'
+            logger.warning("Event loop заблокирован уже %.3f с, стек:\n%s", silence, stack)
+
+# Сторож event loop
+loop_watchdog = LoopWatchdog()
+
+# Обслуживание БД: период, размер пачки удаляемых строк и период ANALYZE/optimize/vacuum (секунды)
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '300'))
+MAINTENANCE_BATCH = int(os.getenv('MAINTENANCE_BATCH', '500'))
+DB_OPTIMIZE_INTERVAL = float(os.getenv('DB_OPTIMIZE_INTERVAL', '86400'))
+
+async def maintenance_loop(interval: float = MAINTENANCE_INTERVAL, batch: int = MAINTENANCE_BATCH, optimize_interval: float = DB_OPTIMIZE_INTERVAL):
+    """Фоновое обслуживание БД
+
+    Удаляет сработавшие одноразовые будильники небольшими пачками, отдавая
+    управление event loop между ними, и периодически выполняет ANALYZE,
+    PRAGMA optimize и incremental vacuum.
+    """
+    last_optimize = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        started = time.perf_counter()
+        reclaimed = 0
+        optimized = False
+        try:
+            while True:
+                purged = storage.purge_fired(batch)
+                reclaimed += purged
+                if purged < batch:
+                    break
+                await asyncio.sleep(0)
+            
+            if time.monotonic() - last_optimize >= optimize_interval:
+                storage.optimize()
+                last_optimize = time.monotonic()
+                optimized = True
+        except sqlite3.Error as e:
+            logger.error("Ошибка обслуживания БД: %s", e)
+        
+        elapsed = time.perf_counter() - started
+        metrics['maintenance_rows_reclaimed'] += reclaimed
+        observe('maintenance_seconds', elapsed)
+        if reclaimed or optimized:
+            logger.info("Обслуживание БД: удалено %d сработавших будильников за %.3f с (оптимизация: %s)", reclaimed, elapsed, optimized)
+
+# Обновления, накопившиеся пока бот не опрашивал Telegram:
+# coalesce - применить последнее намерение каждого пользователя, drop - выбросить
+PENDING_UPDATES = os.getenv('PENDING_UPDATES', 'coalesce').lower()
+# Сколько обновлений запрашивать за один getUpdates при разборе очереди
+DRAIN_BATCH = 100
+
+class PendingIntent:
+    """Итоговое намерение пользователя по накопившимся обновлениям
+
+    Побеждает последняя команда: последний /timezone, последний /set после
+    последнего "стоп", последний /repeat на каждое время. Часовой пояс
+    применяется первым, поэтому время будильников трактуется уже в нем.
+    """
+
+    __slots__ = ('timezone', 'stop', 'one_time', 'recurring')
+
+    def __init__(self):
+        self.timezone: Optional[str] = None
+        self.stop = False
+        # (время, сообщение) последнего /set
+        self.one_time: Optional[Tuple[datetime, str]] = None
+        # Время HH:MM -> (время, сообщение, дни недели)
+        self.recurring: Dict[str, Tuple[datetime, str, Set[int]]] = {}
+
+def coalesce_update(intents: Dict[int, PendingIntent], update: Update) -> bool:
+    """Учитывает накопившееся обновление; False - обновление отброшено"""
+    message = update.message
+    if message is None or message.text is None or update.effective_user is None:
+        return False
+    intent = intents.get(update.effective_user.id) or PendingIntent()
+    text = message.text.strip()
+    
+    if text.lower() in STOP_WORDS:
+        command, args = 'stop', []
+    elif text.startswith('/'):
+        parts = text.split()
+        command, args = parts[0][1:].split('@')[0].lower(), parts[1:]
+    else:
+        return False
+    
+    try:
+        if command == 'stop':
+            intent.stop = True
+            intent.one_time = None
+        elif command == 'set' and args:
+            intent.one_time = (parse_alarm_time(args[0]), " ".join(args[1:]))
+        elif command == 'repeat' and len(args) >= 2:
+            alarm_time = parse_alarm_time(args[0])
+            intent.recurring[alarm_time.strftime("%H:%M")] = (alarm_time, " ".join(args[2:]), parse_repeat_days(args[1]))
+        elif command == 'timezone' and args:
+            ZoneInfo(args[0])
+            intent.timezone = args[0]
+        else:
+            return False
+    except (ValueError, KeyError):
+        # Некорректные команды отбрасываем: ответить на них уже некому
+        return False
+    
+    intents[update.effective_user.id] = intent
+    return True
+
+def apply_pending_intent(user_id: int, intent: PendingIntent) -> List[str]:
+    """Записывает намерение пользователя в БД и возвращает описание примененного"""
+    applied = []
+    if intent.timezone and set_user_timezone(user_id, intent.timezone):
+        applied.append(f"часовой пояс {intent.timezone}")
+    if intent.stop:
+        storage.delete_one_time_alarms(user_id)
+        applied.append("одноразовые будильники остановлены")
+    
+    created_at = get_user_datetime_now(user_id).isoformat()
+    for time_str, (alarm_time, message, repeat_days_set) in intent.recurring.items():
+        if storage.count_alarms(user_id, exclude_recurring_time=time_str) + 1 > MAX_ALARMS_PER_USER:
+            metrics['alarm_limit_rejections'] += 1
+            continue
+        storage.replace_recurring_alarm(user_id, time_str, message, created_at, json.dumps(list(repeat_days_set)))
+        applied.append(f"повторяющийся будильник {time_str} ({format_days(json.dumps(list(repeat_days_set)))})")
+    
+    if intent.one_time:
+        alarm_time, message = intent.one_time
+        if storage.count_alarms(user_id, recurring_only=True) + 1 > MAX_ALARMS_PER_USER:
+            metrics['alarm_limit_rejections'] += 1
+        else:
+            storage.replace_one_time_alarm(user_id, alarm_time.strftime("%H:%M"), message, created_at)
+            applied.append(f"будильник на {alarm_time.strftime('%H:%M')}")
+    return applied
+
+async def drain_pending_updates(app: Application) -> Dict[int, List[str]]:
+    """Разбирает обновления, накопившиеся пока бот не работал
+
+    Вместо того чтобы выбрасывать их (drop_pending_updates) или выполнять
+    каждую команду по очереди, сворачивает их по пользователям и применяет
+    итог одной транзакцией. Возвращает описание примененного по пользователям.
+    """
+    intents: Dict[int, PendingIntent] = {}
+    offset = None
+    total = dropped = 0
+    # Полученная, но еще не подтвержденная Telegram пачка
+    unconfirmed: List[Update] = []
+    started = time.perf_counter()
+    while True:
+        try:
+            updates = await app.bot.get_updates(offset=offset, limit=DRAIN_BATCH, timeout=0, allowed_updates=Update.ALL_TYPES)
+        except Exception as e:
+            # Неподтвержденную пачку Telegram отдаст обычному опросу, поэтому здесь ее не применяем
+            logger.error("Ошибка при разборе накопившихся обновлений: %s", e)
+            metrics['pending_updates_unconfirmed'] += len(unconfirmed)
+            break
+        # Успешный запрос с offset подтвердил предыдущую пачку: только теперь ее можно учесть
+        for update in unconfirmed:
+            total += 1
+            if not coalesce_update(intents, update):
+                dropped += 1
+        unconfirmed = updates
+        if not updates:
+            break
+        offset = updates[-1].update_id + 1
+    
+    summaries: Dict[int, List[str]] = {}
+    if intents:
+        try:
+            with storage.batch():
+                for user_id, intent in intents.items():
+                    applied = apply_pending_intent(user_id, intent)
+                    if applied:
+                        summaries[user_id] = applied
+        except sqlite3.Error as e:
+            logger.error("Не удалось применить накопившиеся команды: %s", e)
+            summaries = {}
+    
+    metrics['pending_updates_drained'] += total
+    metrics['pending_updates_dropped'] += dropped
+    metrics['pending_updates_users_applied'] += len(summaries)
+    if total:
+        logger.info(
+            "Разобрано %d накопившихся обновлений за %.3f с: применены команды %d пользователей, отброшено %d",
+            total, time.perf_counter() - started, len(summaries), dropped
+        )
+    return summaries
+
+async def notify_drained_users(app: Application, summaries: Dict[int, List[str]]):
+    """Сообщает пользователям, какие из их накопившихся команд были применены"""
+    for user_id, applied in summaries.items():
+        text = "♻️ Пока бот был недоступен, вы отправили команды. Применено:\n" + "\n".join(f"• {line}" for line in applied)
+        try:
+            await app.bot.send_message(chat_id=user_id, text=text)
+        except Exception as e:
+            logger.warning("Не удалось уведомить пользователя %d о примененных командах: %s", user_id, e)
+
+# Режим active-passive: работает только экземпляр, удерживающий аренду в БД
+HA_ENABLED = os.getenv('HA_ENABLED', '').lower() in ('1', 'true', 'yes')
+# Срок аренды лидера (секунды); продлевается каждые LEASE_TTL / 3
+LEASE_TTL = float(os.getenv('LEASE_TTL', '15'))
+# Уникальное имя экземпляра
+INSTANCE_ID = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+class LeaderElector:
+    """Выбор лидера через аренду в БД
+
+    Лидер опрашивает Telegram и звонит будильниками, продлевая аренду каждые
+    LEASE_TTL / 3 секунд. Резервный экземпляр с тем же интервалом пытается
+    захватить аренду и изредка прогревает кэши (страницы БД, часовые пояса);
+    как только аренда истекает, он становится лидером и читает будильники
+    из БД заново, поэтому не теряет изменений, сделанных старым лидером.
+    Лидер, не сумевший продлить аренду до ее истечения, сам останавливается,
+    поэтому два экземпляра никогда не звонят одновременно. Гарантия держится
+    на атомарной записи в SQLite (WAL), поэтому экземпляры должны работать
+    на одном хосте с базой на локальном диске.
+    """
+
+    LEASE_NAME = 'leader'
+    # Как часто резерв прогревает кэши (секунды)
+    WARM_INTERVAL = 60.0
+
+    def __init__(self, app: Application, enabled: bool = HA_ENABLED, ttl: float = LEASE_TTL, instance_id: str = INSTANCE_ID):
+        self.app = app
+        self.instance_id = instance_id
+        self.enabled = enabled
+        self.ttl = ttl
+        self.is_leader = False
+        # Когда (по монотонным часам) резерв последний раз прогревал кэши
+        self._warmed_at: Optional[float] = None
+        # Задачи, которые работают только у лидера
+        self._leader_tasks: List[asyncio.Task] = []
+        # До какого момента (по монотонным часам) аренда гарантированно наша
+        self._lease_valid_until = 0.0
+        # Результат последней попытки продлить аренду и событие о ней
+        self._holds_lease = False
+        self._lease_checked = asyncio.Event()
+
+    def _try_acquire(self) -> bool:
+        if not self.enabled:
+            return True
+        started = time.monotonic()
+        try:
+            acquired = storage.try_acquire_lease(self.LEASE_NAME, self.instance_id, self.ttl)
+        except sqlite3.Error as e:
+            logger.error("Не удалось обновить аренду лидера: %s", e)
+            return False
+        if acquired:
+            self._lease_valid_until = started + self.ttl
+        return acquired
+
+    def _lease_safe(self) -> bool:
+        """Аренда наша и не истечет раньше чем через ttl / 3"""
+        return not self.enabled or time.monotonic() < self._lease_valid_until - self.ttl / 3
+
+    async def _renew(self):
+        """Продлевает аренду каждые ttl / 3 секунд независимо от того, чем занят цикл выборов"""
+        while True:
+            self._holds_lease = self._try_acquire()
+            self._lease_checked.set()
+            await asyncio.sleep(self.ttl / 3)
+
+    async def run(self):
+        """Цикл выборов; работает до отмены задачи
+
+        Аренда продлевается отдельной задачей: переключение (разбор накопившихся
+        обновлений, загрузка будильников) может длиться дольше LEASE_TTL.
+        """
+        renewal = None
+        try:
+            if not self.enabled:
+                # Без HA аренда не нужна: просто работаем до остановки
+                await self._become_leader()
+                await asyncio.Event().wait()
+            
+            renewal = asyncio.create_task(self._renew())
+            while True:
+                await self._lease_checked.wait()
+                self._lease_checked.clear()
+                if self._holds_lease and not self.is_leader:
+                    await self._become_leader()
+                elif self.is_leader and not self._lease_safe():
+                    # Аренда вот-вот истечет или уже у другого экземпляра
+                    await self._step_down()
+                elif not self.is_leader:
+                    await self._warm_caches()
+        finally:
+            if renewal is not None:
+                renewal.cancel()
+            if self.is_leader:
+                await self._step_down()
+                if self.enabled:
+                    storage.release_lease(self.LEASE_NAME, self.instance_id)
+
+    async def _warm_caches(self):
+        """Прогревает кэши, чтобы переключение меньше ждало диска
+
+        Сами будильники не запоминаются: к моменту переключения снимок устарел бы.
+        БД читается в отдельном потоке, не блокируя event loop.
+        """
+        if self._warmed_at is not None and time.monotonic() - self._warmed_at < self.WARM_INTERVAL:
+            return
+        self._warmed_at = time.monotonic()
+        try:
+            timezones = await asyncio.to_thread(storage.warm_cache)
+        except sqlite3.Error as e:
+            logger.error("Не удалось прогреть кэши в резерве: %s", e)
+            return
+        for timezone in timezones:
+            try:
+                get_zone(timezone)
+            except Exception:
+                pass  # Некорректный пояс будет отвергнут при планировании
+
+    async def _become_leader(self):
+        logger.info("Экземпляр %s стал лидером, запускаем будильники и опрос Telegram", self.instance_id)
+        metrics['leader_takeovers'] += 1
+        self.is_leader = True
+        summaries: Dict[int, List[str]] = {}
+        if PENDING_UPDATES == 'coalesce':
+            summaries = await drain_pending_updates(self.app)
+        # Читаем будильники заново: старый лидер мог изменить их до самой передачи аренды
+        await engine.load()
+        if not self._lease_safe():
+            # Аренду не удалось удержать во время переключения: резерв мог уже забрать работу
+            logger.error("Аренда истекла во время переключения, экземпляр %s отказывается от лидерства", self.instance_id)
+            metrics['leader_takeovers_aborted'] += 1
+            await self._step_down()
+            return
+        self._leader_tasks.append(asyncio.create_task(maintenance_loop()))
+        if isinstance(engine, RemoteEngine):
+            self._leader_tasks.append(asyncio.create_task(engine_heartbeat()))
+        if summaries:
+            self._leader_tasks.append(asyncio.create_task(notify_drained_users(self.app, summaries)))
+        await self.app.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=PENDING_UPDATES != 'coalesce')
+        await self.app.start()
+
+    async def _step_down(self):
+        logger.warning("Экземпляр %s больше не лидер, останавливаем будильники и опрос Telegram", self.instance_id)
+        self.is_leader = False
+        for task in self._leader_tasks:
+            task.cancel()
+        self._leader_tasks.clear()
+        if self.app.updater.running:
+            await self.app.updater.stop()
+        if self.app.running:
+            await self.app.stop()
+        # Снимаем все будильники: их поднимет новый лидер
+        try:
+            await engine.reset()
+        except EngineError as e:
+            logger.error("Не удалось снять будильники в движке: %s", e)
+
+# Команды, которые процесс движка принимает через сокет
+ENGINE_OPS = ('ping', 'active', 'cancel', 'schedule', 'reschedule', 'load', 'reset')
+
+# Подключенные к движку процессы бота
+engine_clients: Set[asyncio.StreamWriter] = set()
+
+async def handle_engine_client(local: AlarmEngine, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Выполняет команды одного клиента движка, по ответу на каждую строку запроса
+
+    В режиме HA звонить можно только по команде живого лидера: когда
+    отключается последний клиент, движок снимает все будильники. Если
+    процесс бота еще лидер, он переподключится и загрузит их заново.
+    """
+    engine_clients.add(writer)
+    try:
+        while line := await reader.readline():
+            try:
+                request = json.loads(line)
+                op = request.pop('op', None)
+                if op not in ENGINE_OPS:
+                    raise EngineError(f"Неизвестная команда: {op}")
+                if 'alarm_time' in request:
+                    request['alarm_time'] = datetime.strptime(request['alarm_time'], "%H:%M")
+                if request.get('repeat_days') is not None:
+                    request['repeat_days'] = set(request['repeat_days'])
+                metrics[f'engine_ops_{op}'] += 1
+                reply = {'ok': True, 'result': await getattr(local, op)(**request)}
+            except Exception as e:
+                logger.error("Ошибка выполнения команды движка: %s", e)
+                reply = {'ok': False, 'error': str(e)}
+            writer.write(json.dumps(reply).encode() + b'\n')
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        # Клиент отключился или движок останавливается
+        pass
+    finally:
+        engine_clients.discard(writer)
+        writer.close()
+        if HA_ENABLED and not engine_clients:
+            logger.warning("Процесс бота отключился от движка, снимаем будильники до команды нового лидера")
+            metrics['engine_orphan_resets'] += 1
+            await local.reset()
+
+async def run_engine(app: Application, path: str = ENGINE_SOCKET):
+    """Процесс движка: держит таймеры и звонит будильниками, команды получает через Unix-сокет
+
+    Без HA будильники загружаются сразу; в режиме HA движок ждет команды
+    load от процесса бота, ставшего лидером.
+    """
+    setup_logging()
+    local = AlarmEngine(app)
+    await app.initialize()
+    stopped = asyncio.Event()
+    server = None
+    try:
+        await post_init(app)
+        if not HA_ENABLED:
+            await local.load()
+        if os.path.exists(path):
+            os.remove(path)
+        # Сокет доступен только владельцу: через него можно слать сообщения в любые чаты
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(functools.partial(handle_engine_client, local), path=path)
+        finally:
+            os.umask(umask)
+        logger.info("Движок будильников слушает %s", path)
+        try:
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(signal.SIGTERM, stopped.set)
+            loop.add_signal_handler(signal.SIGUSR2, start_profile_from_signal)
+        except (NotImplementedError, RuntimeError, AttributeError):
+            pass  # Windows
+        await stopped.wait()
+    finally:
+        if server is not None:
+            server.close()
+            if os.path.exists(path):
+                os.remove(path)
+        await local.reset()
+        for task in background_tasks:
+            task.cancel()
+        loop_watchdog.stop()
+        fire_trace.stop()
+        await app.shutdown()
+
+async def run_bot(app: Application):
+    """Запускает приложение и цикл выбора лидера до получения сигнала остановки"""
+    elector = LeaderElector(app)
+    await app.initialize()
+    try:
+        await post_init(app)
+        election = asyncio.create_task(elector.run())
+        # SIGTERM от docker/systemd завершает работу штатно, с освобождением аренды
+        try:
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(signal.SIGTERM, election.cancel)
+            # SIGUSR2 снимает профиль без перезапуска (kill -USR2 <pid>)
+            loop.add_signal_handler(signal.SIGUSR2, start_profile_from_signal)
+        except (NotImplementedError, RuntimeError, AttributeError):
+            pass  # Windows
+        try:
+            await election
+        except asyncio.CancelledError:
+            pass
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        loop_watchdog.stop()
+        fire_trace.stop()
+        await app.shutdown()
+
+# Фоновые служебные задачи (держим ссылки, чтобы их не собрал сборщик мусора)
+background_tasks: List[asyncio.Task] = []
+
+async def post_init(app: Application):
+    """Запускает фоновые задачи после инициализации приложения"""
+    background_tasks.append(asyncio.create_task(log_ringing_summary()))
+    background_tasks.append(loop_watchdog.start())
+    fire_trace.start()
+
 def main():
     """Основная функция запуска бота"""
+    setup_logging()
+    
     # Инициализация БД
     init_db()
     
@@ -987,8 +3126,31 @@ def main():
         print("TELEGRAM_BOT_TOKEN=ваш_токен_от_BotFather")
         return
     
+    if ENGINE_SOCKET and STORAGE_BACKEND == 'memory':
+        logger.error("Отдельному процессу движка нужна общая БД: STORAGE_BACKEND=memory не поддерживается")
+        return
+    
+    # python bot.py engine - процесс движка будильников без обработки команд
+    if sys.argv[1:2] == ['engine']:
+        if not ENGINE_SOCKET:
+            logger.error("Для процесса движка нужно задать ENGINE_SOCKET")
+            return
+        logger.info("Движок будильников запущен (HA: %s)...", HA_ENABLED)
+        try:
+            asyncio.run(run_engine(Application.builder().token(token).build()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            storage.close()
+        return
+    
     # Создаем приложение
-    application = Application.builder().token(token).build()
+    application = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES))
+        .build()
+    )
     
     # Регистрируем обработчики
     application.add_handler(CommandHandler("start", start))
@@ -997,14 +3159,24 @@ def main():
     application.add_handler(CommandHandler("stop", stop_alarm))
     application.add_handler(CommandHandler("status", status))
     application.add_handler(CommandHandler("timezone", set_timezone))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("profile", profile_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     
     # Обработчик для inline-кнопок
     application.add_handler(CallbackQueryHandler(button_handler))
     
+    # Будильники звонят через приложение, если движок работает в этом же процессе
+    engine.app = application
+    
     # Запускаем бота
-    logger.info("Бот запущен...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    logger.info("Бот запущен (экземпляр %s, HA: %s)...", INSTANCE_ID, HA_ENABLED)
+    try:
+        asyncio.run(run_bot(application))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        storage.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,93 @@
+"""
+Общие фикстуры тестов: изолированные хранилища и сброс глобального состояния бота
+
+Запуск: python -m pytest -q
+"""
+
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+# Настройки нужно задать до импорта бота
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+from telegram import Chat, Message, Update, User
+
+
+def make_update(update_id: int, user_id: int, text: str = 't') -> Update:
+    user = User(user_id, 'test', False)
+    chat = Chat(user_id, 'private')
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=user, text=text))
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    bot.throttle_buckets.clear()
+    bot.throttle_notified.clear()
+    bot.metrics.clear()
+    yield
+    bot.scheduled_alarms.clear()
+    bot.active_alarms.clear()
+    bot.spam_active.clear()
+    bot.ringing_sessions.clear()
+
+
+@pytest.fixture
+def memory_storage(monkeypatch):
+    store = bot.MemoryStorage()
+    monkeypatch.setattr(bot, 'storage', store)
+    return store
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path, monkeypatch):
+    store = bot.ShardedSQLiteStorage(str(tmp_path / 'alarms.db'), shards=3)
+    store.init()
+    monkeypatch.setattr(bot, 'storage', store)
+    yield store
+    store.close()
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def any_storage(request):
+    return request.getfixturevalue(f'{request.param}_storage')
+
+
+def at(hour: int, minute: int, second: int = 0) -> datetime:
+    """Момент 5 января 2026 года (понедельник) в UTC"""
+    return datetime(2026, 1, 5, hour, minute, second, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def virtual_clock(monkeypatch, memory_storage):
+    """Виртуальные часы на 06:59 UTC, свежие регулятор звонков и прогрев соединения"""
+    clock = bot.VirtualClock(at(6, 59))
+    monkeypatch.setattr(bot, 'clock', clock)
+    monkeypatch.setattr(bot, 'ring_governor', bot.RingGovernor())
+    monkeypatch.setattr(bot, 'connection_warmer', bot.ConnectionWarmer())
+    return clock
+
+
+class RingBot:
+    """Заглушка Bot API на виртуальных часах: запоминает отправки, getMe отвечает за get_me_delay секунд"""
+
+    def __init__(self, get_me_delay: float = 0.0):
+        self.get_me_delay = get_me_delay
+        self.get_me_calls = 0
+        self.sent = []
+
+    async def get_me(self):
+        self.get_me_calls += 1
+        await bot.clock.sleep(self.get_me_delay)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((bot.clock.now(timezone.utc), chat_id, text))
+
+
+class RingApp:
+    def __init__(self, get_me_delay: float = 0.0):
+        self.bot = RingBot(get_me_delay)
@@ -0,0 +1,35 @@
+"""Системные часы: скачки времени во время ожидания будильника"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import bot
+
+
+def test_clock_jump_wakes_pending_alarms(monkeypatch):
+    offset = [timedelta(0)]
+    real_time = bot.time.time
+    monkeypatch.setattr(bot.Clock, 'now', lambda self, tz=None: datetime.now(tz) + offset[0])
+    monkeypatch.setattr(bot.time, 'time', lambda: real_time() + offset[0].total_seconds())
+    monkeypatch.setattr(bot, 'clock', bot.Clock())
+    monkeypatch.setattr(bot, 'MAX_SLEEP_CHUNK', 60.0)
+
+    async def scenario():
+        alarm = bot.Deadline(datetime.now(timezone.utc) + timedelta(seconds=30))
+        bot.scheduled_alarms[1] = {alarm}
+        watchdog = bot.LoopWatchdog(interval=0.05, threshold=10)
+        lag_task = watchdog.start(debug=False)
+        waiter = asyncio.create_task(bot.clock.sleep_until(alarm))
+        try:
+            await asyncio.sleep(0.1)
+            # Пробуждение ВМ: системное время ушло на минуту вперед, монотонное - нет
+            offset[0] = timedelta(seconds=60)
+            lateness = await asyncio.wait_for(waiter, timeout=2)
+        finally:
+            lag_task.cancel()
+            watchdog.stop()
+        return lateness
+
+    lateness = asyncio.run(scenario())
+    assert 30 <= lateness < 31
+    assert bot.metrics['clock_drift_corrections'] == 1
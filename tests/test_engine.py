@@ -0,0 +1,96 @@
+"""Движок будильников: клиент RemoteEngine, сервер handle_engine_client и ответы команд при недоступном движке"""
+
+import asyncio
+import functools
+from types import SimpleNamespace
+
+import bot
+from conftest import RingApp
+
+
+def test_restarted_engine_gets_alarms_without_user_command(memory_storage, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'HA_ENABLED', True)
+    path = str(tmp_path / 'engine.sock')
+    memory_storage.replace_one_time_alarm(1, '07:00', 'wake', 'x')
+    local = bot.AlarmEngine(RingApp())
+    remote = bot.RemoteEngine(path)
+    monkeypatch.setattr(bot, 'engine', remote)
+
+    async def scenario():
+        server = await asyncio.start_unix_server(functools.partial(bot.handle_engine_client, local), path=path)
+        await remote.load()
+        assert set(bot.scheduled_alarms) == {1}
+        heartbeat = asyncio.create_task(bot.engine_heartbeat(0.02))
+        try:
+            # Движок "перезапускается": соединения рвутся, будильники пропадают
+            server.close()
+            for writer in list(bot.engine_clients):
+                writer.close()
+            await asyncio.sleep(0.05)
+            await local.reset()
+            server = await asyncio.start_unix_server(functools.partial(bot.handle_engine_client, local), path=path)
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + 2
+            while not bot.scheduled_alarms:
+                assert loop.time() < deadline, "движок не получил будильники"
+                await asyncio.sleep(0.01)
+        finally:
+            heartbeat.cancel()
+            remote._disconnect()
+            server.close()
+            await local.reset()
+
+    asyncio.run(scenario())
+    assert bot.metrics['engine_reconnects'] >= 1
+
+
+class StubMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def make_command(user_id: int, *args):
+    message = StubMessage()
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=message, effective_message=message)
+    return update, SimpleNamespace(args=list(args)), message
+
+
+def test_commands_reply_when_engine_is_down(memory_storage, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'engine', bot.RemoteEngine(str(tmp_path / 'missing.sock')))
+
+    async def scenario():
+        # /set сначала снимает старые будильники в движке: ничего не сохранено
+        set_update, set_context, set_reply = make_command(1, '07:00', 'wake')
+        await bot.set_alarm(set_update, set_context)
+        stop_update, stop_context, stop_reply = make_command(2)
+        await bot.stop_alarm(stop_update, stop_context)
+        # /timezone успевает записать пояс в БД до обращения к движку
+        tz_update, tz_context, tz_reply = make_command(3, 'Asia/Tokyo')
+        await bot.set_timezone(tz_update, tz_context)
+        return set_reply, stop_reply, tz_reply
+
+    set_reply, stop_reply, tz_reply = asyncio.run(scenario())
+    assert len(set_reply.replies) == 1 and 'недоступен' in set_reply.replies[0]
+    assert memory_storage.get_alarms(1) == []
+    assert len(stop_reply.replies) == 1 and 'недоступен' in stop_reply.replies[0]
+    assert len(tz_reply.replies) == 1 and 'Часовой пояс сохранен' in tz_reply.replies[0]
+    assert memory_storage.get_timezone(3) == 'Asia/Tokyo'
+    assert bot.metrics['engine_unavailable_replies'] == 3
+
+
+def test_set_reports_saved_alarm_when_schedule_fails(memory_storage, monkeypatch):
+    class DownOnSchedule(bot.AlarmEngine):
+        async def schedule(self, *args, **kwargs):
+            raise bot.EngineError("движок недоступен")
+
+    monkeypatch.setattr(bot, 'engine', DownOnSchedule())
+    update, context, reply = make_command(1, '07:00', 'wake')
+
+    asyncio.run(bot.set_alarm(update, context))
+
+    assert len(reply.replies) == 1 and 'Будильник сохранен' in reply.replies[0]
+    assert memory_storage.get_alarms(1) == [('07:00', 'wake', None)]
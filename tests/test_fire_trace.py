@@ -0,0 +1,60 @@
+"""Трасса срабатываний: ротация, переполнение очереди и ошибки записи"""
+
+import json
+import threading
+
+import bot
+
+
+def read_traces(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_trace_rotates_files(tmp_path):
+    path = str(tmp_path / 'fires.jsonl')
+    writer = bot.FireTraceWriter(path, max_bytes=100, backups=2, queue_size=100)
+    # По записи на пачку, чтобы ротация проверялась после каждой
+    writer.BATCH_SIZE = 1
+    writer.start()
+    for i in range(20):
+        writer.record({'alarm': i, 'note': 'x' * 20})
+    writer.stop()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['fires.jsonl', 'fires.jsonl.1', 'fires.jsonl.2']
+    assert bot.metrics['fire_traces_written'] == 20
+    # Старые файлы отброшены, оставшиеся идут по порядку и не превышают лимит
+    kept = read_traces(path + '.2') + read_traces(path + '.1') + read_traces(path)
+    assert [trace['alarm'] for trace in kept] == list(range(20 - len(kept), 20))
+    assert all((tmp_path / name).stat().st_size <= 100 for name in ('fires.jsonl', 'fires.jsonl.1', 'fires.jsonl.2'))
+
+
+def test_full_queue_drops_traces(tmp_path):
+    path = str(tmp_path / 'fires.jsonl')
+    writer = bot.FireTraceWriter(path, max_bytes=0, backups=0, queue_size=3)
+    # Поток записи стоит, пока очередь не переполнится
+    gate = threading.Event()
+    run = writer._run
+    writer._run = lambda: (gate.wait(), run())
+    writer.start()
+    for i in range(100):
+        writer.record({'alarm': i})
+    gate.set()
+    writer.stop()
+
+    assert bot.metrics['fire_traces_dropped'] == 97
+    assert [trace['alarm'] for trace in read_traces(path)] == [0, 1, 2]
+
+
+def test_write_error_disables_trace(tmp_path):
+    writer = bot.FireTraceWriter(str(tmp_path / 'missing' / 'fires.jsonl'), max_bytes=0, backups=0, queue_size=3)
+    writer.start()
+    writer._thread.join(timeout=5)
+
+    assert not writer.enabled
+    for i in range(10):
+        writer.record({'alarm': i})
+    assert bot.metrics['fire_traces_dropped'] == 0
+    # Остановка не ждет места в очереди за умершим потоком
+    writer.stop()
+    assert writer._thread is None
@@ -0,0 +1,93 @@
+"""Аренда лидера и переключение между экземплярами"""
+
+import asyncio
+
+import bot
+
+
+def test_lease_acquire_renew_release(any_storage):
+    assert any_storage.try_acquire_lease('leader', 'a', 30)
+    assert not any_storage.try_acquire_lease('leader', 'b', 30)
+    assert any_storage.try_acquire_lease('leader', 'a', 30)
+
+    # Чужая аренда не освобождается
+    any_storage.release_lease('leader', 'b')
+    assert not any_storage.try_acquire_lease('leader', 'b', 30)
+
+    any_storage.release_lease('leader', 'a')
+    assert any_storage.try_acquire_lease('leader', 'b', 30)
+
+
+def test_expired_lease_can_be_taken(any_storage, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, 'time', lambda: now[0])
+
+    assert any_storage.try_acquire_lease('leader', 'a', 5)
+    now[0] += 4
+    assert not any_storage.try_acquire_lease('leader', 'b', 5)
+    now[0] += 2
+    assert any_storage.try_acquire_lease('leader', 'b', 5)
+    assert not any_storage.try_acquire_lease('leader', 'a', 5)
+
+
+class StubUpdater:
+    running = False
+
+    async def start_polling(self, **kwargs):
+        self.running = True
+
+    async def stop(self):
+        self.running = False
+
+
+class StubApp:
+    def __init__(self):
+        self.updater = StubUpdater()
+        self.running = False
+
+    async def start(self):
+        self.running = True
+
+    async def stop(self):
+        self.running = False
+
+
+async def wait_for(condition, timeout: float = 3.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "условие не выполнилось вовремя"
+        await asyncio.sleep(0.01)
+
+
+def test_leader_takes_over_from_db_and_steps_down(sqlite_storage, monkeypatch):
+    app = StubApp()
+    monkeypatch.setattr(bot, 'engine', bot.AlarmEngine(app))
+    monkeypatch.setattr(bot, 'PENDING_UPDATES', 'drop')
+
+    async def scenario():
+        sqlite_storage.try_acquire_lease('leader', 'old', 0.3)
+        sqlite_storage.replace_one_time_alarm(1, '07:00', 'before', 'x')
+        elector = bot.LeaderElector(app, enabled=True, ttl=0.3, instance_id='new')
+        task = asyncio.create_task(elector.run())
+        try:
+            await asyncio.sleep(0.05)
+            assert not elector.is_leader
+            # Старый лидер успевает изменить БД перед передачей аренды
+            sqlite_storage.replace_one_time_alarm(2, '08:00', 'after', 'x')
+            sqlite_storage.delete_one_time_alarms(1)
+
+            await wait_for(lambda: elector.is_leader and app.running)
+            assert app.updater.running
+            assert set(bot.scheduled_alarms) == {2}
+
+            # Аренду больше не удается продлить: лидер сам останавливается
+            monkeypatch.setattr(sqlite_storage, 'try_acquire_lease', lambda *args: False)
+            await wait_for(lambda: not elector.is_leader)
+            assert not app.updater.running and not app.running
+            assert bot.scheduled_alarms == {}
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
@@ -0,0 +1,108 @@
+"""Накопившиеся обновления: сворачивание по пользователям и применение итога"""
+
+import asyncio
+
+import bot
+from conftest import make_update
+
+
+def test_coalesce_keeps_last_intent():
+    intents = {}
+    texts = ['/set 07:00 first', '/timezone Europe/Moscow', 'стоп', '/set 08:00 second',
+             '/repeat 09:00 12345 work', '/repeat 09:00 67 weekend']
+    assert all(bot.coalesce_update(intents, make_update(i, 1, text)) for i, text in enumerate(texts))
+
+    intent = intents[1]
+    assert intent.timezone == 'Europe/Moscow'
+    assert intent.stop
+    assert intent.one_time == (bot.parse_alarm_time('08:00'), 'second')
+    assert list(intent.recurring) == ['09:00']
+    assert intent.recurring['09:00'][1:] == ('weekend', bot.parse_repeat_days('67'))
+
+
+def test_coalesce_drops_invalid_updates():
+    intents = {}
+    for i, text in enumerate(['hello', '/set 99:99', '/timezone Bad/Zone', '/repeat 09:00', '/unknown']):
+        assert not bot.coalesce_update(intents, make_update(i, 1, text))
+    assert intents == {}
+
+
+def test_stop_cancels_earlier_set():
+    intents = {}
+    bot.coalesce_update(intents, make_update(1, 1, '/set 07:00'))
+    bot.coalesce_update(intents, make_update(2, 1, '/stop'))
+    assert intents[1].stop and intents[1].one_time is None
+
+
+def test_apply_pending_intent_writes_storage(memory_storage):
+    memory_storage.replace_one_time_alarm(1, '06:00', 'old', 'x')
+    intents = {}
+    for i, text in enumerate(['/timezone Asia/Tokyo', 'стоп', '/set 07:30 new', '/repeat 09:00 12345 work']):
+        bot.coalesce_update(intents, make_update(i, 1, text))
+
+    applied = bot.apply_pending_intent(1, intents[1])
+
+    assert len(applied) == 4
+    assert memory_storage.get_timezone(1) == 'Asia/Tokyo'
+    assert sorted(memory_storage.get_alarms(1)) == sorted([
+        ('07:30', 'new', None),
+        ('09:00', 'work', bot.json.dumps(list(bot.parse_repeat_days('12345')))),
+    ])
+
+
+def test_apply_pending_intent_respects_alarm_limit(memory_storage, monkeypatch):
+    monkeypatch.setattr(bot, 'MAX_ALARMS_PER_USER', 1)
+    memory_storage.replace_recurring_alarm(1, '06:00', 'gym', 'x', '[0]')
+    intents = {}
+    bot.coalesce_update(intents, make_update(1, 1, '/set 07:00'))
+
+    assert bot.apply_pending_intent(1, intents[1]) == []
+    assert memory_storage.count_alarms(1) == 1
+    assert bot.metrics['alarm_limit_rejections'] == 1
+
+
+class QueuedUpdatesBot:
+    """Заглушка getUpdates: отдает накопившиеся обновления пачками, запрос номер fail_on падает"""
+
+    def __init__(self, updates, fail_on=None):
+        self.updates = updates
+        self.fail_on = fail_on
+        self.offsets = []
+
+    async def get_updates(self, offset=None, limit=100, **kwargs):
+        self.offsets.append(offset)
+        if len(self.offsets) == self.fail_on:
+            raise ConnectionError("сеть недоступна")
+        return [update for update in self.updates if offset is None or update.update_id >= offset][:limit]
+
+
+class DrainApp:
+    def __init__(self, fake_bot):
+        self.bot = fake_bot
+
+
+def test_drain_applies_confirmed_batches(memory_storage, monkeypatch):
+    monkeypatch.setattr(bot, 'DRAIN_BATCH', 2)
+    updates = [make_update(1, 1, '/set 07:00'), make_update(2, 2, '/set 08:00'), make_update(3, 3, '/timezone UTC')]
+    fake_bot = QueuedUpdatesBot(updates)
+
+    summaries = asyncio.run(bot.drain_pending_updates(DrainApp(fake_bot)))
+
+    assert fake_bot.offsets == [None, 3, 4]
+    assert set(summaries) == {1, 2, 3}
+    assert bot.metrics['pending_updates_drained'] == 3
+
+
+def test_drain_skips_unconfirmed_batch_on_failure(memory_storage, monkeypatch):
+    monkeypatch.setattr(bot, 'DRAIN_BATCH', 2)
+    updates = [make_update(1, 1, '/set 07:00'), make_update(2, 2, '/set 08:00'),
+               make_update(3, 3, '/set 09:00'), make_update(4, 4, '/set 10:00')]
+    # Третий запрос подтвердил бы вторую пачку, но падает
+    fake_bot = QueuedUpdatesBot(updates, fail_on=3)
+
+    summaries = asyncio.run(bot.drain_pending_updates(DrainApp(fake_bot)))
+
+    # Вторую пачку повторит обычный опрос с offset 3: применять ее здесь - значит выполнить дважды
+    assert set(summaries) == {1, 2}
+    assert memory_storage.get_alarms(3) == [] and memory_storage.get_alarms(4) == []
+    assert bot.metrics['pending_updates_unconfirmed'] == 2
@@ -0,0 +1,65 @@
+"""Прогрев перед срабатыванием будильника"""
+
+import asyncio
+from datetime import timedelta
+
+import bot
+from conftest import RingApp, at
+
+
+def test_slow_prewarm_does_not_delay_first_ring(virtual_clock):
+    app = RingApp(get_me_delay=5.0)
+
+    async def scenario():
+        await bot.schedule_alarm(app, 1, bot.parse_alarm_time('07:00'), 'wake')
+        await bot.schedule_alarm(app, 2, bot.parse_alarm_time('07:00'), 'wake')
+        await virtual_clock.advance(60)
+        await bot.AlarmEngine().cancel(1)
+        await bot.AlarmEngine().cancel(2)
+        await virtual_clock.advance(1)
+
+    asyncio.run(scenario())
+    # getMe еще не ответил, а первые сообщения уже ушли вовремя
+    assert sorted((sent_at, chat_id) for sent_at, chat_id, _ in app.bot.sent) == [(at(7, 0), 1), (at(7, 0), 2)]
+    assert app.bot.get_me_calls == 1
+    assert bot.metrics['fire_lateness_seconds_max'] == 0
+
+
+def test_moved_alarm_releases_first_send_reservation(virtual_clock):
+    app = RingApp()
+
+    async def scenario():
+        await bot.schedule_alarm(app, 1, bot.parse_alarm_time('07:00'), 'wake')
+        await virtual_clock.advance(59)
+        assert bot.ring_governor.pending_first == 1
+        # Будильник перенесли на два часа вперед прямо во время прогрева
+        alarm = next(iter(bot.scheduled_alarms[1]))
+        alarm.move(alarm.target_utc + timedelta(hours=2))
+        await virtual_clock.advance(0)
+        assert bot.ring_governor.pending_first == 0
+        assert bot.metrics['prewarm_reservations_released'] == 1
+        # Перед новым моментом резерв берется снова и освобождается первой отправкой
+        await virtual_clock.advance(2 * 3600 - 1)
+        assert bot.ring_governor.pending_first == 1
+        await virtual_clock.advance(3)
+        assert bot.ring_governor.pending_first == 0
+        await bot.AlarmEngine().cancel(1)
+        await virtual_clock.advance(1)
+
+    asyncio.run(scenario())
+    assert app.bot.sent[0][:2] == (at(9, 0), 1)
+
+
+def test_cancelled_alarm_releases_first_send_reservation(virtual_clock):
+    app = RingApp()
+
+    async def scenario():
+        await bot.schedule_alarm(app, 1, bot.parse_alarm_time('07:00'), 'wake')
+        await virtual_clock.advance(59)
+        assert bot.ring_governor.pending_first == 1
+        await bot.AlarmEngine().cancel(1)
+        await virtual_clock.advance(0)
+        assert bot.ring_governor.pending_first == 0
+
+    asyncio.run(scenario())
+    assert app.bot.sent == []
@@ -0,0 +1,79 @@
+"""Звонки: перегрузка исходящих сообщений и ответы Telegram 429"""
+
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+import bot
+from conftest import RingApp, at
+
+
+# Конструктор RetryAfter сам обращается к устаревшему int-значению retry_after
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+def test_retry_after_pauses_ringing_instead_of_ending_it(virtual_clock):
+    app = RingApp()
+    plain_send = app.bot.send_message
+    calls = [0]
+
+    async def send_message(chat_id, text, **kwargs):
+        calls[0] += 1
+        if calls[0] == 2:
+            raise RetryAfter(5)
+        await plain_send(chat_id, text, **kwargs)
+
+    app.bot.send_message = send_message
+
+    async def scenario():
+        await bot.schedule_alarm(app, 1, bot.parse_alarm_time('07:00'), 'wake')
+        await virtual_clock.advance(70)
+        assert bot.ring_governor._saturated_until is not None
+        await bot.AlarmEngine().cancel(1)
+        await virtual_clock.advance(1)
+
+    asyncio.run(scenario())
+    sent_at = [moment for moment, _, _ in app.bot.sent]
+    # 07:00:00 ушло, 07:00:02 получило 429 на 5 с, дальше звонок продолжается
+    assert sent_at[:3] == [at(7, 0), at(7, 0, 7), at(7, 0, 9)]
+    assert bot.metrics['ring_retry_after'] == 1
+    assert bot.ring_log_stats['errors'] == 0
+
+
+def test_retry_after_stretches_long_rings_until_it_expires(virtual_clock):
+    governor = bot.RingGovernor(rate=25, long_after=60, max_stretch=4)
+    session = bot.RingingSession(1, bot.PreparedAlarm(bot.get_zone('UTC'), 'wake', at(6, 0)))
+    session.ticks = 10
+    session.started = virtual_clock.monotonic() - 600
+    bot.ringing_sessions[1] = session
+
+    # Один долгий звонок укладывается в лимит
+    assert governor.interval('long') == bot.RING_INTERVAL
+    governor.saturated(5)
+    assert governor.interval('long') == bot.RING_INTERVAL * 4
+    assert governor.interval('first') == bot.RING_INTERVAL
+
+    asyncio.run(virtual_clock.advance(6))
+    assert governor.interval('long') == bot.RING_INTERVAL
+
+
+def test_overlapping_alarms_merge_into_one_ringing_session(virtual_clock):
+    app = RingApp()
+
+    async def scenario():
+        await bot.schedule_alarm(app, 1, bot.parse_alarm_time('07:00'), 'one')
+        await bot.schedule_alarm(app, 1, bot.parse_alarm_time('07:00'), 'daily', set(range(7)))
+        await bot.schedule_alarm(app, 1, bot.parse_alarm_time('07:01'), 'later')
+        await virtual_clock.advance(130)
+        assert len(bot.ringing_sessions) == 1
+        await bot.AlarmEngine().cancel(1)
+        await virtual_clock.advance(1)
+
+    asyncio.run(scenario())
+    sent_at = [moment for moment, _, _ in app.bot.sent]
+    # Один звонок: сообщения идут с обычным интервалом, а не по одному на будильник
+    assert sent_at[0] == at(7, 0)
+    assert all((b - a).total_seconds() == bot.RING_INTERVAL for a, b in zip(sent_at, sent_at[1:]))
+    assert bot.metrics['ringing_sessions_merged'] == 2
+    last_text = app.bot.sent[-1][2]
+    assert all(message in last_text for message in ('one', 'daily', 'later'))
+    assert bot.ringing_sessions == {}
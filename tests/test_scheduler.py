@@ -0,0 +1,41 @@
+"""Планировщик: перенос ожидающих будильников без пересоздания задач"""
+
+import asyncio
+
+import bot
+from conftest import RingApp, at
+
+
+def test_timezone_change_moves_pending_alarm_in_place(virtual_clock, memory_storage):
+    app = RingApp()
+
+    async def scenario():
+        await bot.schedule_alarm(app, 1, bot.parse_alarm_time('07:00'), 'wake')
+        await bot.schedule_alarm(app, 2, bot.parse_alarm_time('07:00'), 'other')
+        task = bot.active_alarms[1][0]
+
+        # 06:59 UTC = 15:59 в Токио: следующий 07:00 по Токио - в 22:00 UTC
+        memory_storage.set_timezone(1, 'Asia/Tokyo')
+        assert bot.reschedule_user_alarms(1) == 1
+        assert bot.active_alarms[1] == [task]
+        assert next(iter(bot.scheduled_alarms[1])).target_utc == at(22, 0)
+
+        await virtual_clock.advance(70)
+        assert {chat_id for _, chat_id, _ in app.bot.sent} == {2}
+        await bot.AlarmEngine().cancel(2)
+
+        await virtual_clock.advance(15 * 3600)
+        await bot.AlarmEngine().cancel(1)
+        await virtual_clock.advance(1)
+
+    asyncio.run(scenario())
+    first_rings = {}
+    for sent_at, chat_id, _ in app.bot.sent:
+        first_rings.setdefault(chat_id, sent_at)
+    assert first_rings == {1: at(22, 0), 2: at(7, 0)}
+    assert bot.metrics['alarms_rescheduled'] == 1
+
+
+def test_reschedule_without_pending_alarms_is_noop(virtual_clock):
+    assert bot.reschedule_user_alarms(1) == 0
+    assert bot.metrics['alarms_rescheduled'] == 0
@@ -0,0 +1,36 @@
+"""Хранилища: ID будильников в шардах и строки iter_all_alarms"""
+
+import os
+
+
+def test_sharded_ids_encode_shard(sqlite_storage):
+    ids = {user_id: sqlite_storage.replace_one_time_alarm(user_id, '07:00', 'msg', 'x') for user_id in range(7)}
+
+    assert len(set(ids.values())) == len(ids)
+    for user_id, alarm_id in ids.items():
+        assert alarm_id % 3 == user_id % 3
+    assert {row[0]: row[1] for row in sqlite_storage.iter_all_alarms()} == {alarm_id: user_id for user_id, alarm_id in ids.items()}
+    assert [os.path.basename(path) for path in sqlite_storage.paths] == ['alarms.0.db', 'alarms.1.db', 'alarms.2.db']
+
+
+def test_iter_all_alarms_yields_five_fields(any_storage):
+    one_time = any_storage.replace_one_time_alarm(4, '07:00', 'wake', 'x')
+    recurring = any_storage.replace_recurring_alarm(4, '08:30', 'gym', 'x', '[0, 2]')
+
+    assert sorted(any_storage.iter_all_alarms()) == sorted([
+        (one_time, 4, '07:00', 'wake', None),
+        (recurring, 4, '08:30', 'gym', '[0, 2]'),
+    ])
+
+
+def test_mark_fired_hides_only_that_alarm(any_storage):
+    fired = any_storage.replace_one_time_alarm(5, '07:00', 'a', 'x')
+    other = any_storage.replace_one_time_alarm(8, '07:00', 'b', 'x')
+
+    any_storage.mark_fired(5, fired, '2026-01-01T07:00:00+00:00')
+
+    assert [row[0] for row in any_storage.iter_all_alarms()] == [other]
+    assert any_storage.get_alarms(5) == []
+    assert any_storage.count_alarms(5) == 0
+    assert any_storage.purge_fired(100) == 1
+    assert any_storage.purge_fired(100) == 0
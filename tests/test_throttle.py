@@ -0,0 +1,31 @@
+"""Token bucket: ограничение частоты изменяющих команд"""
+
+import bot
+
+
+def test_throttle_allows_burst_then_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(bot, 'THROTTLE_BURST', 3.0)
+    monkeypatch.setattr(bot, 'THROTTLE_RATE', 0.5)
+
+    assert [bot.throttle_allow(1) for _ in range(4)] == [True, True, True, False]
+    # Ведро другого пользователя не тронуто
+    assert bot.throttle_allow(2)
+
+    now[0] += 1.9
+    assert not bot.throttle_allow(1)
+    now[0] += 0.2
+    assert bot.throttle_allow(1)
+    assert not bot.throttle_allow(1)
+
+
+def test_throttle_bucket_never_exceeds_burst(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(bot, 'THROTTLE_BURST', 2.0)
+    monkeypatch.setattr(bot, 'THROTTLE_RATE', 1.0)
+
+    assert bot.throttle_allow(1)
+    now[0] += 3600
+    assert [bot.throttle_allow(1) for _ in range(3)] == [True, True, False]
@@ -0,0 +1,34 @@
+"""Обработка обновлений: один пользователь - по очереди, разные - параллельно"""
+
+import asyncio
+
+import bot
+from conftest import make_update
+
+
+def test_per_user_processor_keeps_order_per_user():
+    async def scenario():
+        processor = bot.PerUserUpdateProcessor(max_concurrent_updates=4, max_pending_updates=100)
+        log = []
+
+        async def handle(update_id: int, delay: float):
+            log.append(('start', update_id))
+            await asyncio.sleep(delay)
+            log.append(('end', update_id))
+
+        # Первое обновление пользователя 1 долгое, остальные короткие
+        plan = [(1, 0.2), (1, 0.0), (2, 0.0), (1, 0.0)]
+        await asyncio.gather(*(
+            processor.process_update(make_update(i, user_id), handle(i, delay))
+            for i, (user_id, delay) in enumerate(plan)
+        ))
+        return log, processor
+
+    log, processor = asyncio.run(scenario())
+    user1 = [event for event in log if event[1] in (0, 1, 3)]
+    assert user1 == [('start', 0), ('end', 0), ('start', 1), ('end', 1), ('start', 3), ('end', 3)]
+    # Пользователь 2 не ждал долгого обновления пользователя 1
+    assert log.index(('end', 2)) < log.index(('end', 0))
+    # Блокировки освобождаются, когда очередь пользователя пуста
+    assert processor._user_locks == {}
+    assert processor._user_waiters == {}